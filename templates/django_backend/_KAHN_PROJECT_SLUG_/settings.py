@@ -215,7 +215,7 @@ REST_FRAMEWORK = {
     ],
     "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.IsAdminUser"],
     "DEFAULT_RENDERER_CLASSES": [
-        "rest_framework.renderers.JSONRenderer",
+        "tools.dynamic_rest.renderers.DynamicJSONRenderer",
     ],
     "TEST_REQUEST_DEFAULT_FORMAT": "json",
 }
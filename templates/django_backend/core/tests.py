@@ -1,9 +1,62 @@
-from django.contrib.auth.models import User
+import base64
+import datetime
+import decimal
+import json
+import threading
+import uuid
+from unittest import mock
+
+from django.contrib.auth.models import Group, User
+from django.core.paginator import InvalidPage
+from django.db import connection, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import F, Q
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
-from rest_framework import status
+from rest_framework import serializers, status
 from rest_framework.authtoken.models import Token
-from rest_framework.test import APITestCase
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.test import APIRequestFactory, APITestCase
 import core.models as core_models
+import core.serializers as core_serializers
+import core.views as core_views
+from tools.dynamic_rest.caching import (
+    count_cache,
+    fastquery_cache,
+    fields_cache,
+    filter_plan_cache,
+    representation_cache,
+)
+from tools.dynamic_rest.fields import DynamicRelationField
+from tools.dynamic_rest.filters import (
+    DynamicFilterBackend,
+    DynamicSortingFilter,
+    FilterNode,
+    has_multivalued_joins,
+)
+from tools.dynamic_rest.metadata import DynamicMetadata
+from tools.dynamic_rest.pagination import DynamicCursorPagination
+from tools.dynamic_rest.paginator import (
+    DynamicPaginator,
+    encode_cursor,
+    get_seek_ordering,
+)
+from tools.dynamic_rest.prefetch import (
+    FastColumns,
+    FastPrefetch,
+    FastQuery,
+    FastRow,
+    HybridObject,
+)
+import tools.dynamic_rest.processors as processors
+from tools.dynamic_rest.serializers import WithDynamicModelSerializerMixin
+from tools.dynamic_rest.viewsets import DynamicModelViewSet
+from tools.dynamic_rest.paths import get_field_path, get_field_path_index
+from tools.dynamic_rest.processors import SideloadingProcessor
+from tools.dynamic_rest.renderers import DynamicJSONRenderer
+from tools.dynamic_rest.routers import resource_map
+from tools.dynamic_rest.tagged import get_tags, tag_dict
 
 
 class AccountTests(APITestCase):
@@ -29,3 +82,1206 @@ class AccountTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(core_models.Customer.objects.count(), 1)
         self.assertEqual(core_models.Customer.objects.get().name, "Rowan")
+
+
+class FastQueryTests(TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.users = [
+            User.objects.create(username=f"user{i}", first_name=f"First{i}")
+            for i in range(3)
+        ]
+        core_models.UserProfile.objects.create(user=self.users[0])
+        for i in range(6):
+            core_models.Example.objects.create(
+                title=f"Example {i}",
+                example_type=core_models.Example.Type.FOO,
+                likes=i,
+                created_by=self.users[i % 3],
+            )
+
+    def test_only_projects_columns(self):
+        query = (
+            FastQuery(core_models.Example.objects.order_by("id"))
+            .only("title")
+            .prefetch_related(
+                FastPrefetch(
+                    "created_by", FastQuery(User.objects.all()).only("first_name")
+                )
+            )
+        )
+        rows = list(query)
+        self.assertEqual(
+            set(rows[0].keys()), {"id", "title", "created_by_id", "created_by"}
+        )
+        self.assertEqual(set(rows[0].created_by.keys()), {"id", "first_name"})
+        self.assertEqual(rows[1].created_by.first_name, "First1")
+
+    def test_only_keeps_reverse_keys(self):
+        query = (
+            FastQuery(User.objects.order_by("id"))
+            .only("username")
+            .prefetch_related(
+                FastPrefetch(
+                    "profile",
+                    FastQuery(core_models.UserProfile.objects.all()).only("uuid"),
+                ),
+                FastPrefetch(
+                    "examples",
+                    FastQuery(core_models.Example.objects.all()).only("likes"),
+                ),
+            )
+        )
+        rows = list(query)
+        self.assertEqual(rows[0].profile.user_id, self.users[0].pk)
+        self.assertIsNone(rows[1].profile)
+        self.assertEqual(sorted(e.likes for e in rows[0].examples), [0, 3])
+
+    def test_iterator_merges_prefetches_per_chunk(self):
+        def make_query():
+            return FastQuery(
+                core_models.Example.objects.order_by("id")
+            ).prefetch_related(FastPrefetch("created_by", User.objects.all()))
+
+        streamed = list(make_query().iterator(chunk_size=4))
+        self.assertEqual(streamed, list(make_query()))
+        self.assertEqual(
+            [row.created_by.username for row in streamed],
+            [f"user{i % 3}" for i in range(6)],
+        )
+
+    def test_nested_prefetch_batches_each_level(self):
+        query = FastQuery(User.objects.order_by("id")).prefetch_related(
+            "examples__created_by__profile", "examples__created_by"
+        )
+        # One query for the root and one per prefetch level.
+        with self.assertNumQueries(4):
+            rows = list(query)
+        self.assertEqual(len(rows[0].examples), 2)
+        self.assertEqual(rows[0].examples[0].created_by.profile.user_id, rows[0].id)
+        self.assertIsNone(rows[1].examples[0].created_by.profile)
+
+        # Adding rows does not add queries.
+        for i in range(3):
+            core_models.Example.objects.create(
+                title=f"Extra {i}",
+                example_type=core_models.Example.Type.FOO,
+                likes=i,
+                created_by=self.users[i],
+            )
+        with self.assertNumQueries(4):
+            list(query._clone())
+
+    def test_prefetch_ids_are_batched(self):
+        def fetch():
+            examples = FastQuery(core_models.Example.objects.order_by("id"))
+            users = FastQuery(User.objects.order_by("id"))
+            return (
+                list(examples.prefetch_related("created_by")),
+                list(users.prefetch_related("examples", "profile")),
+            )
+
+        expected = fetch()
+        with override_settings(DYNAMIC_REST={"FASTQUERY_IN_BATCH_SIZE": 2}):
+            # 3 users: 1 root query + 2 batches per prefetch
+            with self.assertNumQueries(3 + 5):
+                self.assertEqual(fetch(), expected)
+
+    def test_seek_pages_match_offset_pages(self):
+        def make_query():
+            return FastQuery(core_models.Example.objects.order_by("-likes"))
+
+        expected = [row.title for row in make_query()]
+        titles, cursor = [], None
+        while True:
+            paginator = DynamicPaginator(make_query(), 4)
+            rows, cursor = paginator.seek_page(cursor)
+            titles.extend(row.title for row in rows)
+            if cursor is None:
+                break
+        self.assertEqual(titles, expected)
+
+        ordering = get_seek_ordering(make_query())
+        self.assertEqual(ordering, [("likes", True), ("pk", False)])
+        last = core_models.Example.objects.get(likes=3)
+        rows = make_query().seek([3, last.pk])[:2]
+        self.assertEqual([row.likes for row in rows], [2, 1])
+
+        with self.assertRaises(InvalidPage):
+            DynamicPaginator(make_query(), 4).seek_page("not-a-cursor")
+
+    def test_malformed_cursors_are_invalid(self):
+        def make_query():
+            return FastQuery(core_models.Example.objects.order_by("-likes"))
+
+        ordering = get_seek_ordering(make_query())
+        for key in (5, {"a": 1}, [3], [3, 1, 1], [[3], 1], ["x", 1], [3, None]):
+            cursor = encode_cursor(ordering, key)
+            with self.assertRaises(InvalidPage, msg=key):
+                DynamicPaginator(make_query(), 4).seek_page(cursor)
+
+        with self.assertRaises(InvalidPage):
+            DynamicPaginator(User.objects.order_by("groups__name"), 4).seek_page()
+
+    def test_seek_pages_with_null_sort_keys(self):
+        for i, avatar in enumerate(["b", "a", "b"]):
+            user = User.objects.create(username=f"avatar{i}")
+            core_models.UserProfile.objects.create(user=user, avatar=avatar)
+        avatars = dict(User.objects.values_list("pk", "profile__avatar"))
+        nulls = sorted(pk for pk, avatar in avatars.items() if avatar is None)
+        values = [pk for pk in sorted(avatars) if avatars[pk] is not None]
+        expected = {
+            "profile__avatar": sorted(values, key=avatars.get) + nulls,
+            "-profile__avatar": nulls + sorted(values, key=avatars.get, reverse=True),
+        }
+
+        for ordering, pks in expected.items():
+            for per_page in (1, 2):
+                seen, cursor = [], None
+                while True:
+                    paginator = DynamicPaginator(
+                        User.objects.order_by(ordering), per_page
+                    )
+                    rows, cursor = paginator.seek_page(cursor)
+                    seen.extend(row.pk for row in rows)
+                    if cursor is None:
+                        break
+                self.assertEqual(seen, pks, (ordering, per_page))
+
+        query = FastQuery(User.objects.order_by("profile__avatar"))
+        rows = query.seek([None, nulls[0]])
+        self.assertEqual([row.id for row in rows], nulls[1:])
+
+    def test_hybrid_rows_fall_back_to_model_instances(self):
+        core_models.Example.USE_FASTQUERY = False
+        self.addCleanup(delattr, core_models.Example, "USE_FASTQUERY")
+
+        rows = list(
+            FastQuery(core_models.Example.objects.order_by("id")).prefetch_related(
+                "created_by"
+            )
+        )
+        row = rows[0]
+        self.assertIsInstance(row, HybridObject)
+        self.assertEqual(row.title, "Example 0")
+        self.assertEqual(row.created_by.username, "user0")
+        with self.assertNumQueries(0):
+            self.assertEqual(row.get_example_type_display(), "Foo")
+            self.assertIsInstance(row.instance, core_models.Example)
+            self.assertEqual(row.instance.pk, row.pk)
+
+    def test_hybrid_rows_render_method_fields(self):
+        User.USE_FASTQUERY = False
+        self.addCleanup(delattr, User, "USE_FASTQUERY")
+        self.users[0].set_unusable_password()
+        self.users[0].save()
+        self.users[1].set_password("password")
+        self.users[1].save()
+
+        rows = list(FastQuery(User.objects.order_by("id")))
+        self.assertIsInstance(rows[0], HybridObject)
+        expected = [False, True, True]
+        self.assertEqual(
+            [core_serializers.User(row).data["has_usable_password"] for row in rows],
+            expected,
+        )
+        data = core_serializers.User(rows, many=True).data
+        self.assertEqual([user["has_usable_password"] for user in data], expected)
+
+    def test_prefetch_unknown_field_is_validation_error(self):
+        with self.assertRaises(ValidationError):
+            FastQuery(User.objects.all()).prefetch_related("examples__nope")
+
+    def test_m2m_join_matches_separate_queries(self):
+        groups = [Group.objects.create(name=f"group{i}") for i in range(3)]
+        self.users[0].groups.set(groups)
+        self.users[1].groups.set(groups[:1])
+
+        def fetch():
+            query = FastQuery(User.objects.order_by("id")).prefetch_related(
+                FastPrefetch(
+                    "groups", FastQuery(Group.objects.order_by("id")).only("name")
+                )
+            )
+            return [[group.name for group in row.groups] for row in query]
+
+        with override_settings(DYNAMIC_REST={"FASTQUERY_M2M_JOIN": False}):
+            with self.assertNumQueries(3):
+                separate = fetch()
+        with override_settings(DYNAMIC_REST={"FASTQUERY_M2M_JOIN": True}):
+            with self.assertNumQueries(2):
+                joined = fetch()
+        self.assertEqual(joined, separate)
+        self.assertEqual(joined, [["group0", "group1", "group2"], ["group0"], []])
+
+    def test_compact_rows_match_dict_rows(self):
+        def fetch():
+            return list(
+                FastQuery(core_models.Example.objects.order_by("id"))
+                .only("title")
+                .prefetch_related("created_by__profile")
+            )
+
+        rows = fetch()
+        with override_settings(DYNAMIC_REST={"FASTQUERY_COMPACT_ROWS": True}):
+            compact = fetch()
+        self.assertEqual(compact, rows)
+
+        row = compact[0]
+        self.assertIsInstance(row, FastRow)
+        self.assertEqual(row.pk, rows[0].pk)
+        self.assertEqual(row["title"], "Example 0")
+        self.assertEqual(row.created_by.username, "user0")
+        self.assertEqual(row._slow_getattr("created_by.username"), "user0")
+        self.assertIn("created_by_id", row)
+        self.assertNotIn("likes", row)
+        with self.assertRaises(AttributeError):
+            row.likes
+
+    def test_column_representation_matches_rows(self):
+        rows = list(
+            FastQuery(core_models.Example.objects.order_by("id")).prefetch_related(
+                "created_by"
+            )
+        )
+        serializer = core_serializers.Example(
+            rows, many=True, request_fields={"created_by": {}}
+        )
+        self.assertTrue(serializer._can_represent_columns())
+
+        child = serializer.child
+        expected = [child._to_representation(row) for row in rows]
+        self.assertEqual(child.to_representation_rows(rows), expected)
+        self.assertEqual(serializer.data, expected)
+        self.assertTrue(expected[0]["created"].endswith("Z"))
+
+
+class FastQueryCacheTests(TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        fastquery_cache.clear()
+        self.user = User.objects.create(username="user0", first_name="First0")
+        self.example = core_models.Example.objects.create(
+            title="Example 0",
+            example_type=core_models.Example.Type.FOO,
+            likes=0,
+            created_by=self.user,
+        )
+
+    def make_query(self, **kwargs):
+        return (
+            FastQuery(core_models.Example.objects.order_by("id"))
+            .prefetch_related("created_by__groups")
+            .cache(**kwargs)
+        )
+
+    def test_hit_runs_no_queries(self):
+        list(self.make_query())
+        with self.assertNumQueries(0):
+            rows = list(self.make_query())
+        self.assertEqual(rows[0].created_by.first_name, "First0")
+
+    def test_different_sql_misses(self):
+        list(self.make_query())
+        with self.assertNumQueries(3):
+            list(self.make_query().filter(likes=0))
+
+    def test_signals_invalidate_prefetched_models(self):
+        list(self.make_query())
+        self.user.first_name = "Changed"
+        self.user.save()
+        with self.assertNumQueries(3):
+            rows = list(self.make_query())
+        self.assertEqual(rows[0].created_by.first_name, "Changed")
+
+        self.user.groups.add(Group.objects.create(name="group0"))
+        rows = list(self.make_query())
+        self.assertEqual(len(rows[0].created_by.groups), 1)
+
+        self.example.delete()
+        self.assertEqual(list(self.make_query()), [])
+
+    def test_commit_invalidates_again(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = "Changed"
+            self.user.save()
+            # a concurrent reader could cache the uncommitted version
+            list(self.make_query())
+        with self.assertNumQueries(3):
+            rows = list(self.make_query())
+        self.assertEqual(rows[0].created_by.first_name, "Changed")
+
+    def test_patch_all_query_invalidates(self):
+        list(self.make_query())
+        DynamicModelViewSet()._patch_all_query(
+            core_models.Example.objects.all(), {"title": "Patched"}
+        )
+        self.assertEqual(list(self.make_query())[0].title, "Patched")
+
+    def test_timeout_and_eviction(self):
+        list(self.make_query(timeout=0))
+        with self.assertNumQueries(3):
+            list(self.make_query())
+
+        with override_settings(DYNAMIC_REST={"FASTQUERY_CACHE_MAX_ENTRIES": 1}):
+            list(self.make_query().filter(likes=0))
+            self.assertEqual(len(fastquery_cache), 1)
+            with self.assertNumQueries(3):
+                list(self.make_query())
+
+
+class CountStrategyTests(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create(username="admin")
+        for i in range(5):
+            self.create_example(i)
+        count_cache.clear()
+        self.addCleanup(count_cache.clear)
+
+    def create_example(self, i):
+        core_models.Example.objects.create(
+            title=f"Example {i}",
+            example_type=core_models.Example.Type.FOO,
+            likes=i,
+            created_by=self.user,
+        )
+
+    def get_paginator(self, count_strategy, queryset=None):
+        if queryset is None:
+            queryset = core_models.Example.objects.order_by("pk")
+        return DynamicPaginator(queryset, 2, count_strategy=count_strategy)
+
+    def test_exact(self):
+        paginator = self.get_paginator("exact")
+        with self.assertNumQueries(1):
+            self.assertEqual(paginator.count, 5)
+        self.assertEqual(paginator.count_strategy_used, "exact")
+
+    def test_cached_until_saved(self):
+        queryset = core_models.Example.objects.filter(likes__gte=1).order_by("pk")
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_paginator("cached", queryset).count, 4)
+        with self.assertNumQueries(0):
+            # the ordering doesn't change the count
+            paginator = self.get_paginator(
+                "cached", FastQuery(queryset.order_by("-likes"))
+            )
+            self.assertEqual(paginator.count, 4)
+        self.assertEqual(paginator.count_strategy_used, "cached")
+
+        self.create_example(5)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_paginator("cached", queryset).count, 5)
+
+    @override_settings(DYNAMIC_REST={"PAGINATION_COUNT_ESTIMATE_THRESHOLD": 3})
+    def test_estimated_from_table_statistics(self):
+        # no statistics yet
+        paginator = self.get_paginator("estimated")
+        self.assertEqual(paginator.count, 5)
+        self.assertEqual(paginator.count_strategy_used, "exact")
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        self.create_example(5)
+        paginator = self.get_paginator("estimated")
+        self.assertEqual(paginator.count, 5)
+        self.assertEqual(paginator.count_strategy_used, "estimated")
+        # pages past the estimate aren't cut short or rejected
+        self.assertEqual(paginator.num_pages, 3)
+        self.assertEqual(len(paginator.page(3)), 2)
+        self.assertEqual(len(paginator.page(4)), 0)
+
+        paginator = self.get_paginator(
+            "estimated", core_models.Example.objects.filter(likes=1).order_by("pk")
+        )
+        self.assertEqual(paginator.count, 1)
+        self.assertEqual(paginator.count_strategy_used, "exact")
+
+
+class ConcurrentPrefetchTests(TransactionTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        group = Group.objects.create(name="group0")
+        for i in range(3):
+            user = User.objects.create(username=f"user{i}")
+            user.groups.add(group)
+            core_models.UserProfile.objects.create(user=user)
+            core_models.Example.objects.create(
+                title=f"Example {i}",
+                example_type=core_models.Example.Type.FOO,
+                likes=i,
+                created_by=user,
+            )
+
+    def fetch(self):
+        query = FastQuery(User.objects.order_by("id")).prefetch_related(
+            "profile", "examples", "groups"
+        )
+        return list(query)
+
+    def fetch_on_threads(self):
+        threads = set()
+
+        def on_connect(sender, connection, **kwargs):
+            threads.add(threading.current_thread().name)
+
+        connection_created.connect(on_connect)
+        try:
+            with override_settings(DYNAMIC_REST={"FASTQUERY_PREFETCH_THREADS": 3}):
+                rows = self.fetch()
+        finally:
+            connection_created.disconnect(on_connect)
+        return rows, threads
+
+    def test_siblings_fetched_on_worker_threads(self):
+        rows, threads = self.fetch_on_threads()
+        self.assertEqual(rows, self.fetch())
+        self.assertTrue(threads)
+        self.assertTrue(all(name.startswith("fastquery-prefetch") for name in threads))
+
+    def test_sequential_inside_atomic(self):
+        with transaction.atomic():
+            rows, threads = self.fetch_on_threads()
+        self.assertEqual(threads, set())
+        self.assertEqual(rows, self.fetch())
+
+
+class AdminEmail(serializers.Serializer):
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.context.get("admin"):
+            fields["email"] = serializers.EmailField()
+        return fields
+
+
+class ContextUser(WithDynamicModelSerializerMixin, AdminEmail):
+    ENABLE_FIELDS_CACHE = False
+    first_name = serializers.CharField()
+
+    class Meta:
+        model = User
+
+
+class SerializerPlanTests(TestCase):
+    def test_plans_are_shared_by_request_shape(self):
+        first = core_serializers.Example(
+            request_fields={"likes": False, "created_by": {}}
+        )
+        second = core_serializers.Example(
+            request_fields={"created_by": {"first_name": True}, "likes": False}
+        )
+        self.assertIs(first.get_plan(), second.get_plan())
+        self.assertNotIn("likes", first.fields)
+        self.assertIn("created_by", second.fields)
+
+        other = core_serializers.Example(request_fields={"created_by": False})
+        self.assertIsNot(first.get_plan(), other.get_plan())
+        self.assertNotIn("created_by", other.fields)
+        self.assertIn("likes", other.fields)
+
+    def test_fields_are_not_copied_or_shared(self):
+        first = core_serializers.Example()
+        second = core_serializers.Example()
+        self.assertIs(first.fields["title"], first.get_all_fields()["title"])
+        self.assertIsNot(first.fields["title"], second.fields["title"])
+        self.assertIs(second.fields["title"].parent, second)
+
+    def test_uncached_serializers_are_planned_per_instance(self):
+        user = User.objects.create(username="user", email="user@a.com")
+        for admin in (False, True, False):
+            serializer = ContextUser(user, context={"admin": admin})
+            self.assertEqual("email" in serializer.data, admin)
+
+    def test_invalid_field_is_parse_error(self):
+        serializer = core_serializers.Example(request_fields={"nope": True})
+        with self.assertRaises(ParseError):
+            serializer.fields
+
+
+class FilterPlanTests(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create(
+            username="admin", is_staff=True, is_superuser=True
+        )
+        for i in range(6):
+            core_models.Example.objects.create(
+                title=f"Example {i}",
+                example_type=core_models.Example.Type.FOO,
+                likes=i,
+                is_good_example=i % 2 == 0,
+                created_by=self.user,
+            )
+        self.client.force_authenticate(self.user)
+        filter_plan_cache.clear()
+        self.addCleanup(filter_plan_cache.clear)
+
+    def get_likes(self, query):
+        data = self.client.get(f"/examples/?{query}").json()
+        return sorted(example["likes"] for example in data["examples"])
+
+    def test_plans_are_shared_by_filter_shape(self):
+        query = (
+            "filter{likes.gte}=%s&filter{is_good_example}=%s"
+            "&filter{-title}=Example%%204"
+        )
+        self.assertEqual(self.get_likes(query % (1, "true")), [2])
+        self.assertEqual(filter_plan_cache.stats()["misses"], 1)
+        self.assertEqual(self.get_likes(query % (0, "false")), [1, 3, 5])
+        self.assertEqual(self.get_likes(query % (3, "1")), [])
+        self.assertEqual(filter_plan_cache.stats(), {"hits": 2, "misses": 1, "size": 1})
+
+        self.assertEqual(self.get_likes("filter{likes.lt}=2"), [0, 1])
+        self.assertEqual(filter_plan_cache.stats()["misses"], 2)
+
+    @override_settings(DYNAMIC_REST={"ENABLE_FIELDS_CACHE": False})
+    def test_plans_are_not_shared_without_fields_cache(self):
+        self.assertEqual(self.get_likes("filter{likes.lt}=2"), [0, 1])
+        self.assertEqual(self.get_likes("filter{likes.lt}=3"), [0, 1, 2])
+        self.assertEqual(filter_plan_cache.stats()["size"], 0)
+
+    def test_complex_filters(self):
+        query = "filter{}=" + json.dumps(
+            {".or": [{"likes.lt": 1}, {"likes.gt": 3, "-title": "Example 5"}]}
+        )
+        self.assertEqual(self.get_likes(query), [0, 4])
+        self.assertEqual(self.get_likes(query.replace("1", "2")), [0, 1, 4])
+        self.assertEqual(filter_plan_cache.stats(), {"hits": 1, "misses": 1, "size": 1})
+
+
+class FieldPathIndexTests(TestCase):
+    def test_paths_resolve_to_lookups(self):
+        serializer = core_serializers.User()
+        path = get_field_path(serializer, ["profile", "uuid"])
+        self.assertIs(path, get_field_path(serializer, ("profile", "uuid")))
+        self.assertEqual(path.filter_lookup, "profile__uuid")
+        self.assertEqual(path.sort_lookup, "profile__uuid")
+        self.assertIn(
+            ("uuid",), get_field_path_index(core_serializers.UserProfile).paths
+        )
+
+        path = get_field_path(serializer, ["has_usable_password"])
+        self.assertFalse(path.filterable)
+        self.assertTrue(path.sortable)
+        self.assertIsNone(get_field_path(serializer, ["profile", "nope"]))
+
+    @override_settings(DYNAMIC_REST={"ENABLE_FIELDS_CACHE": False})
+    def test_nothing_is_indexed_without_fields_cache(self):
+        self.assertIsNone(get_field_path(core_serializers.User(), ["email"]))
+        self.assertIsNone(
+            get_field_path(core_serializers.Example(), ["created_by", "first_name"])
+        )
+        node = FilterNode(["created_by", "first_name"], "icontains", "a")
+        self.assertEqual(
+            node.generate_query_key(core_serializers.Example())[0],
+            "created_by__first_name__icontains",
+        )
+
+    def test_filtering_and_sorting_use_the_index(self):
+        serializer = core_serializers.Example()
+        node = FilterNode(["created_by", "first_name"], "icontains", "a")
+        self.assertEqual(
+            node.generate_query_key(serializer)[0],
+            "created_by__first_name__icontains",
+        )
+        with self.assertRaises(ValidationError):
+            FilterNode(["created_by", "nope"], None, "a").generate_query_key(serializer)
+
+        view = mock.Mock(
+            serializer_class=core_serializers.Example, ordering_fields=None
+        )
+        del view.get_serializer_class
+        sorting = DynamicSortingFilter()
+        self.assertEqual(
+            sorting.ordering_for("created_by.last_name", view),
+            "created_by__last_name",
+        )
+        self.assertIsNone(sorting.ordering_for("created_by.nope", view))
+
+    def test_metadata_flags(self):
+        view = mock.Mock(ordering_fields=["title"])
+        properties = {"title": {}, "likes": {}}
+        DynamicMetadata().add_field_path_info(
+            properties, core_serializers.Example(), view
+        )
+        self.assertEqual(
+            properties,
+            {
+                "title": {"filterable": True, "sortable": True},
+                "likes": {"filterable": True, "sortable": False},
+            },
+        )
+
+
+class UserWithExamples(core_serializers.User):
+    examples = DynamicRelationField(core_serializers.Example, many=True)
+
+
+class ToManyFilterTests(TestCase):
+    def setUp(self) -> None:
+        for i in range(4):
+            user = User.objects.create(
+                username=f"user{i}", email=f"user{i}@example.com"
+            )
+            for likes in range(i + 1):
+                core_models.Example.objects.create(
+                    title=f"Example {i}.{likes}",
+                    example_type=core_models.Example.Type.FOO,
+                    likes=likes,
+                    is_good_example=likes % 2 == 1,
+                    created_by=user,
+                )
+
+    def filter_users(self, filters_map=None, complex_filters=None):
+        backend = DynamicFilterBackend()
+        if complex_filters:
+            filters = {"_complex": complex_filters}
+        else:
+            filters = backend._get_requested_filters(filters_map=filters_map)
+        query = backend._filters_to_query(filters, UserWithExamples())
+        return User.objects.filter(query)
+
+    def assertSameUsers(self, queryset, expected):
+        sql = str(queryset.query)
+        self.assertIn("EXISTS", sql)
+        self.assertNotIn("JOIN", sql.split("EXISTS")[0])
+        self.assertFalse(has_multivalued_joins(queryset))
+        self.assertEqual(
+            list(queryset.order_by("pk")),
+            list(expected.distinct().order_by("pk")),
+        )
+
+    def test_includes_use_exists(self):
+        self.assertSameUsers(
+            self.filter_users({"examples.likes.gte": ["2"]}),
+            User.objects.filter(examples__likes__gte=2),
+        )
+        # Conditions on the same relation must match the same rows.
+        self.assertSameUsers(
+            self.filter_users(
+                {"examples.likes.gte": ["2"], "examples.title.icontains": ["1."]}
+            ),
+            User.objects.filter(
+                examples__likes__gte=2, examples__title__icontains="1."
+            ),
+        )
+        self.assertSameUsers(
+            self.filter_users(
+                {
+                    "examples.likes.lt": ["1"],
+                    "email.in": ["user1@example.com", "user2@example.com"],
+                }
+            ),
+            User.objects.filter(
+                examples__likes__lt=1,
+                email__in=["user1@example.com", "user2@example.com"],
+            ),
+        )
+
+    def test_complex_filters_use_exists(self):
+        complex_filters = {
+            ".or": [
+                {"examples.likes.gte": 3},
+                {"email": "user1@example.com", "-examples.is_good_example": True},
+            ]
+        }
+        self.assertSameUsers(
+            self.filter_users(complex_filters=complex_filters),
+            User.objects.filter(
+                Q(examples__likes__gte=3)
+                | Q(email="user1@example.com") & ~Q(examples__is_good_example=True)
+            ),
+        )
+
+    def test_excludes_and_single_valued_filters(self):
+        users = self.filter_users({"-examples.likes.gte": ["2"]})
+        self.assertEqual(
+            sorted(users.values_list("username", flat=True)), ["user0", "user1"]
+        )
+        self.assertFalse(has_multivalued_joins(users))
+
+        examples = core_models.Example.objects.filter(created_by__username="user1")
+        self.assertFalse(has_multivalued_joins(examples))
+
+    @override_settings(DYNAMIC_REST={"FILTER_TO_MANY_WITH_EXISTS": False})
+    def test_can_be_disabled(self):
+        users = self.filter_users({"examples.likes.gte": ["2"]})
+        self.assertNotIn("EXISTS", str(users.query))
+        self.assertTrue(has_multivalued_joins(users))
+
+
+class TagsTests(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create(username="author", first_name="A")
+        for i in range(3):
+            core_models.Example.objects.create(
+                title=f"Example {i}",
+                example_type=core_models.Example.Type.FOO,
+                likes=i,
+                created_by=self.user,
+            )
+
+    def test_representations_are_tagged_plain_dicts(self):
+        serializer = core_serializers.Example(
+            core_models.Example.objects.order_by("id"),
+            many=True,
+            request_fields={"created_by": {}},
+            sideloading=True,
+            envelope=True,
+        )
+        data = serializer.data
+        self.assertEqual(len(data["users"]), 1)
+        self.assertEqual(
+            [example["created_by"] for example in data["examples"]],
+            [self.user.pk] * 3,
+        )
+
+        tags = get_tags(serializer.context)
+        example = data["examples"][0]
+        self.assertIs(type(example), dict)
+        self.assertEqual(tags.get(example).instance.title, "Example 0")
+        self.assertEqual(tags.get(data["users"][0]).instance, self.user)
+        self.assertIsNone(tags.get({}))
+
+    def test_tagged_dicts_are_sideloaded(self):
+        example = core_models.Example.objects.first()
+        serializer = core_serializers.Example()
+        user = tag_dict(
+            {"first_name": "A"},
+            serializer=core_serializers.ExampleUser(),
+            instance=self.user,
+        )
+        data = SideloadingProcessor(
+            serializer,
+            [
+                tag_dict(
+                    {"title": example.title, "created_by": user},
+                    serializer=serializer,
+                    instance=example,
+                )
+            ],
+        ).data
+        self.assertEqual(data["users"], [{"first_name": "A"}])
+        self.assertEqual(data["examples"][0]["created_by"], self.user.pk)
+
+
+class SideloadingProcessorTests(TestCase):
+    def test_records_are_merged_by_pk(self):
+        users = [User.objects.create(username=f"u{i}") for i in range(2)]
+        serializer = core_serializers.Example()
+        user_serializer = core_serializers.ExampleUser()
+        tags = get_tags(serializer.context)
+        data = []
+        for i, fields in enumerate(
+            [{"first_name": "A"}, {"first_name": "B"}, {"last_name": "Z"}]
+        ):
+            user = tags.tag(fields, user_serializer, users[i % 2])
+            example = core_models.Example(pk=i + 1, title=str(i))
+            data.append(tags.tag({"created_by": user}, serializer, example))
+
+        data = SideloadingProcessor(serializer, data).data
+        self.assertEqual(
+            data["users"],
+            [{"first_name": "A", "last_name": "Z"}, {"first_name": "B"}],
+        )
+        self.assertEqual(
+            [example["created_by"] for example in data["examples"]],
+            [users[0].pk, users[1].pk, users[0].pk],
+        )
+
+    def process_tree(self):
+        user = User.objects.create(username="author")
+        profile = core_models.UserProfile.objects.create(user=user)
+        serializer = core_serializers.Example()
+        tags = get_tags(serializer.context)
+        profile_data = tags.tag(
+            {"avatar": None}, core_serializers.UserProfile(), profile
+        )
+        user_data = tags.tag(
+            {"first_name": "A", "profile": profile_data},
+            core_serializers.User(),
+            user,
+        )
+        example = tags.tag(
+            {
+                "title": "t",
+                "created_by": user_data,
+                # not a relation field, e.g. the contents of a JSON field
+                "extra": tags.tag(
+                    {"avatar": None}, core_serializers.UserProfile(), profile
+                ),
+            },
+            serializer,
+            core_models.Example(pk=1),
+        )
+
+        stats = []
+
+        @processors.register_sideloading_hook
+        def record_stats(processor, processor_stats):
+            stats.append(processor_stats)
+
+        self.addCleanup(processors.SIDELOADING_HOOKS.pop, "record_stats")
+        data = SideloadingProcessor(serializer, [example]).data
+        return data, stats, profile
+
+    def test_only_relations_are_sideloaded(self):
+        data, stats, profile = self.process_tree()
+        self.assertEqual(data["user_profiles"], [{"avatar": None}])
+        self.assertEqual(data["users"], [{"first_name": "A", "profile": profile.pk}])
+        self.assertEqual(data["examples"][0]["extra"], {"avatar": None})
+        self.assertEqual(stats[0]["nodes"], 4)
+
+    @override_settings(DYNAMIC_REST={"SIDELOADING_MAX_DEPTH": 1})
+    def test_max_depth(self):
+        data, stats, profile = self.process_tree()
+        self.assertNotIn("user_profiles", data)
+        self.assertEqual(
+            data["users"], [{"first_name": "A", "profile": {"avatar": None}}]
+        )
+        self.assertEqual(stats[0]["nodes"], 3)
+
+
+class ImmutableTitleExample(core_serializers.Example):
+    class Meta(core_serializers.Example.Meta):
+        immutable_fields = ["title"]
+
+
+class FieldsCacheTests(TestCase):
+    def make_serializer(self, method):
+        request = APIRequestFactory().generic(method, "/")
+        return ImmutableTitleExample(
+            context={"request": request}, request_fields={"created_by": {}}
+        )
+
+    def test_hits_share_prototypes_not_fields(self):
+        fields_cache.clear()
+        first = self.make_serializer("GET")
+        second = self.make_serializer("GET")
+        self.assertIsNot(first.fields["title"], second.fields["title"])
+        self.assertEqual(fields_cache.stats(), {"hits": 1, "misses": 1, "size": 1})
+
+        prototypes = first.get_all_fields().prototypes
+        self.assertNotIn(first.fields["title"], prototypes.values())
+        with self.assertRaises(TypeError):
+            prototypes["title"] = None
+
+    def test_no_field_state_leaks_between_threads(self):
+        threads = 8
+        barrier = threading.Barrier(threads)
+        errors = []
+
+        def worker(i):
+            method = "POST" if i % 2 else "GET"
+            barrier.wait()
+            try:
+                for _ in range(50):
+                    serializer = self.make_serializer(method)
+                    title = serializer.fields["title"]
+                    # immutable fields are writable on POST only
+                    if title.read_only != (method == "GET"):
+                        errors.append("read_only leaked into %s" % method)
+                    if title.parent is not serializer:
+                        errors.append("parent leaked")
+                    if title.help_text is not None:
+                        errors.append("help_text leaked")
+                    title.help_text = "thread %s" % i
+            except Exception as e:
+                errors.append(repr(e))
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        self.assertEqual(errors, [])
+
+
+@override_settings(DYNAMIC_REST={"ENABLE_REPRESENTATION_CACHE": True})
+class RepresentationCacheTests(TestCase):
+    def setUp(self) -> None:
+        representation_cache.clear()
+        self.user = User.objects.create(username="cached", first_name="Ada")
+        self.example = core_models.Example.objects.create(
+            title="Example",
+            example_type=core_models.Example.Type.FOO,
+            likes=1,
+            created_by=self.user,
+        )
+
+    def serialize(self):
+        example = core_models.Example.objects.get(pk=self.example.pk)
+        return core_serializers.Example(example, request_fields={"created_by": {}}).data
+
+    def test_leaves_are_cached_until_saved(self):
+        self.assertEqual(self.serialize()["created_by"]["first_name"], "Ada")
+        # only the embedded user is a leaf
+        self.assertEqual(len(representation_cache), 1)
+
+        # updates that don't send signals aren't seen
+        User.objects.filter(pk=self.user.pk).update(first_name="Bob")
+        self.assertEqual(self.serialize()["created_by"]["first_name"], "Ada")
+
+        User.objects.get(pk=self.user.pk).save()
+        self.assertEqual(self.serialize()["created_by"]["first_name"], "Bob")
+
+    def test_bounded_by_size(self):
+        with override_settings(DYNAMIC_REST={"REPRESENTATION_CACHE_MAX_BYTES": 4096}):
+            for i in range(100):
+                representation_cache.set(i, {"title": "x" * 100})
+            self.assertLessEqual(representation_cache.size, 4096)
+            self.assertLess(len(representation_cache), 100)
+            self.assertIsNotNone(representation_cache.get(99))
+            self.assertIsNone(representation_cache.get(0))
+
+
+class LinksTests(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create(
+            username="admin", is_staff=True, is_superuser=True
+        )
+        self.example = core_models.Example.objects.create(
+            title="Example",
+            example_type=core_models.Example.Type.FOO,
+            created_by=self.user,
+        )
+        self.client.force_authenticate(self.user)
+
+    @mock.patch.dict(resource_map, {"core_example": {"path": "examples"}})
+    def test_links_by_record_and_by_convention(self):
+        data = self.client.get("/examples/?exclude[]=created_by").json()
+        self.assertEqual(
+            data["examples"][0]["links"],
+            {"created_by": f"/examples/{self.example.pk}/created_by/"},
+        )
+        self.assertNotIn("links", data)
+
+        data = self.client.get(
+            "/examples/?exclude[]=created_by&links_by_convention"
+        ).json()
+        self.assertNotIn("links", data["examples"][0])
+        self.assertEqual(
+            data["links"], {"examples": {"created_by": "/examples/{pk}/created_by/"}}
+        )
+
+
+class TextRenderer(BaseRenderer):
+    media_type = "text/plain"
+    format = "txt"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return str(data).encode()
+
+
+class StreamingListTests(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create(
+            username="admin", is_staff=True, is_superuser=True
+        )
+        for i in range(7):
+            core_models.Example.objects.create(
+                title=f"Example {i}",
+                example_type=core_models.Example.Type.FOO,
+                likes=i,
+                created_by=self.user,
+            )
+        self.client.force_authenticate(self.user)
+
+    def get_both(self, query):
+        response = self.client.get("/examples/?" + query)
+        streamed = self.client.get("/examples/?stream=1&" + query)
+        self.assertTrue(streamed.streaming)
+        data = json.loads(b"".join(streamed.streaming_content))
+        self.assertEqual(data, response.json())
+        return data
+
+    def test_streamed_pages_match(self):
+        data = self.get_both("include[]=created_by.&sideloading=true&per_page=3&page=2")
+        self.assertEqual(len(data["examples"]), 3)
+        self.assertEqual(len(data["users"]), 1)
+        self.assertEqual(data["meta"]["total_results"], 7)
+        self.assertEqual(data["meta"]["count_strategy"], "exact")
+
+        data = self.get_both("exclude_count=1&per_page=3&page=2&sort[]=title")
+        self.assertEqual(
+            [e["title"] for e in data["examples"]],
+            ["Example 3", "Example 4", "Example 5"],
+        )
+        self.assertTrue(data["meta"]["more_pages"])
+        data = self.get_both("exclude_count=1&per_page=3&page=3&sort[]=title")
+        self.assertFalse(data["meta"]["more_pages"])
+
+    def test_streams_through_the_negotiated_renderer(self):
+        with mock.patch.object(
+            core_views.ExampleViewSet,
+            "renderer_classes",
+            [JSONRenderer, TextRenderer],
+        ):
+            streamed = self.client.get("/examples/?stream=1&per_page=3&format=json")
+            self.assertTrue(streamed.streaming)
+            self.assertEqual(streamed["Content-Type"], "application/json")
+            data = json.loads(b"".join(streamed.streaming_content))
+            self.assertEqual(len(data["examples"]), 3)
+
+            response = self.client.get("/examples/?stream=1&per_page=3&format=txt")
+            self.assertFalse(response.streaming)
+            self.assertEqual(response["Content-Type"], "text/plain; charset=utf-8")
+
+    def test_errors_before_the_first_chunk_are_handled(self):
+        with mock.patch.object(
+            processors.StreamingSideloadingProcessor,
+            "add",
+            side_effect=ValidationError("nope"),
+        ):
+            response = self.client.get("/examples/?stream=1&per_page=3")
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@mock.patch.object(
+    core_views.ExampleViewSet, "pagination_class", DynamicCursorPagination
+)
+class CursorPaginationTests(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create(
+            username="admin", is_staff=True, is_superuser=True
+        )
+        for i in range(8):
+            core_models.Example.objects.create(
+                title=f"Example {i}",
+                example_type=core_models.Example.Type.FOO,
+                likes=i % 3,
+                created_by=self.user,
+            )
+        self.client.force_authenticate(self.user)
+
+    def get_page(self, cursor=None, stream=False):
+        query = "per_page=3&sort[]=-likes&include[]=created_by.&sideloading=true"
+        if cursor is not None:
+            query += f"&cursor={cursor}"
+        if not stream:
+            return self.client.get(f"/examples/?{query}").json()
+        response = self.client.get(f"/examples/?stream=1&{query}")
+        return json.loads(b"".join(response.streaming_content))
+
+    def test_pages_follow_cursors_both_ways(self):
+        expected = list(
+            core_models.Example.objects.order_by("-likes", "pk").values_list(
+                "title", flat=True
+            )
+        )
+        pages = [self.get_page()]
+        self.assertIsNone(pages[0]["meta"]["previous_cursor"])
+        self.assertNotIn("total_results", pages[0]["meta"])
+        self.assertEqual(len(pages[0]["users"]), 1)
+        while pages[-1]["meta"]["next_cursor"]:
+            pages.append(self.get_page(pages[-1]["meta"]["next_cursor"]))
+        self.assertEqual(
+            [[e["title"] for e in page["examples"]] for page in pages],
+            [expected[0:3], expected[3:6], expected[6:8]],
+        )
+        self.assertFalse(pages[-1]["meta"]["more_pages"])
+
+        page = pages[-1]
+        for previous in reversed(pages[:-1]):
+            page = self.get_page(page["meta"]["previous_cursor"])
+            self.assertEqual(page["examples"], previous["examples"])
+        self.assertIsNone(page["meta"]["previous_cursor"])
+        self.assertEqual(page["meta"]["next_cursor"], pages[0]["meta"]["next_cursor"])
+
+        cursor = pages[1]["meta"]["next_cursor"]
+        self.assertEqual(self.get_page(cursor, stream=True), pages[2])
+
+    def test_pages_follow_cursors_over_null_sort_keys(self):
+        for i, avatar in enumerate(["b", None, "a", "b"]):
+            user = User.objects.create(username=f"user{i}", email=f"user{i}@a.com")
+            if avatar is not None:
+                core_models.UserProfile.objects.create(user=user, avatar=avatar)
+        User.objects.create(username="no-profile", email="no-profile@a.com")
+        avatar = F("profile__avatar")
+        expected = {
+            "profile.avatar": avatar.asc(nulls_last=True),
+            "-profile.avatar": avatar.desc(nulls_first=True),
+        }
+
+        with mock.patch.object(
+            core_views.UserViewSet, "pagination_class", DynamicCursorPagination
+        ):
+            for sort, order_by in expected.items():
+                url = f"/users/?per_page=2&sort[]={sort}&exclude[]=profile"
+                pages = [self.client.get(url).json()]
+                while pages[-1]["meta"]["next_cursor"]:
+                    cursor = pages[-1]["meta"]["next_cursor"]
+                    response = self.client.get(f"{url}&cursor={cursor}")
+                    self.assertEqual(response.status_code, status.HTTP_200_OK)
+                    pages.append(response.json())
+                self.assertEqual(
+                    [user["email"] for page in pages for user in page["users"]],
+                    list(
+                        User.objects.order_by(order_by, "pk").values_list(
+                            "email", flat=True
+                        )
+                    ),
+                )
+
+                page = pages[-1]
+                for previous in reversed(pages[:-1]):
+                    cursor = page["meta"]["previous_cursor"]
+                    page = self.client.get(f"{url}&cursor={cursor}").json()
+                    self.assertEqual(page["users"], previous["users"])
+                self.assertIsNone(page["meta"]["previous_cursor"])
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get("/examples/?per_page=3&cursor=not-a-cursor")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_tampered_cursors_are_not_found(self):
+        meta = self.get_page(self.get_page()["meta"]["next_cursor"])["meta"]
+        for cursor in (meta["next_cursor"], meta["previous_cursor"]):
+            data = json.loads(
+                base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            )
+            for key in (5, {"a": 1}, data["k"][:1], ["x", data["k"][1]]):
+                tampered = base64.urlsafe_b64encode(
+                    json.dumps(dict(data, k=key)).encode()
+                ).decode()
+                response = self.client.get(
+                    f"/examples/?per_page=3&sort[]=-likes&cursor={tampered}"
+                )
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, key)
+
+
+class RendererTests(TestCase):
+    def test_output_matches_json_renderer(self):
+        row = FastRow(FastColumns(["id", "name"]), [1, "row"])
+        data = {
+            "examples": [
+                tag_dict(
+                    {"uuid": uuid.uuid4(), "title": "line\u2028break\u2029"},
+                    serializer=None,
+                    instance=None,
+                ),
+                row,
+            ],
+            "created": datetime.datetime(
+                2024, 1, 2, 3, 4, 5, 678901, tzinfo=datetime.timezone.utc
+            ),
+            "day": datetime.date(2024, 1, 2),
+            "price": decimal.Decimal("1.10"),
+            "tuple": (1, 2.5, None, True),
+            1: "integer key",
+        }
+        self.assertEqual(
+            DynamicJSONRenderer().render(data), JSONRenderer().render(data)
+        )
+        self.assertEqual(
+            DynamicJSONRenderer().render(data, "application/json; indent=2"),
+            JSONRenderer().render(data, "application/json; indent=2"),
+        )
+        self.assertEqual(DynamicJSONRenderer().render(None), b"")
+        # too large for orjson
+        self.assertEqual(
+            DynamicJSONRenderer().render({"n": 2**70}), b'{"n":%d}' % 2**70
+        )
@@ -14,6 +14,7 @@ import core.serializers as core_serializers
 from _KAHN_PROJECT_SLUG_.settings import GIT_VERSION
 from tools.dynamic_rest.viewsets import (
     WithDynamicViewSetMixin,
+    DynamicListModelMixin,
     ViewSetReturnType,
     ViewSetReturnTypeItem,
     pagination_params,
@@ -100,7 +101,7 @@ class UserViewSet(
     WithDynamicViewSetMixin,
     CreateModelMixin,
     PartialUpdateModelMixin,
-    mixins.ListModelMixin,
+    DynamicListModelMixin,
     GenericViewSet,
 ):
     serializer_class = core_serializers.User
@@ -139,7 +140,7 @@ class ExampleViewSet(
     CreateModelMixin,
     mixins.RetrieveModelMixin,
     PartialUpdateModelMixin,
-    mixins.ListModelMixin,
+    DynamicListModelMixin,
     mixins.DestroyModelMixin,
     GenericViewSet,
 ):
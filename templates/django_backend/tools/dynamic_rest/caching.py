@@ -0,0 +1,347 @@
+"""This module contains process-wide caches."""
+
+from collections import OrderedDict
+import sys
+import threading
+import time
+from types import MappingProxyType
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from tools.dynamic_rest.conf import settings
+
+
+class TableVersions(object):
+    """Per-table version counters.
+
+    Model signals (see the bottom of this module) bump the versions of
+    the sender's tables. Writes that do not send signals
+    (`QuerySet.update()`, `bulk_create()`, raw SQL) are not seen.
+    """
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def _get_versions(self, tables):
+        return tuple(self._versions.get(table, 0) for table in tables)
+
+    def get_versions(self, tables):
+        """Snapshot the versions of `tables`."""
+        with self._lock:
+            return self._get_versions(tables)
+
+    def invalidate(self, model):
+        """Bump the versions of `model`'s tables."""
+        tables = [model._meta.db_table] + [
+            parent._meta.db_table for parent in model._meta.get_parent_list()
+        ]
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+
+class FastQueryCache(TableVersions):
+    """Process-wide LRU cache of executed FastQuery results.
+
+    Entries expire after a timeout, and the least recently used entry
+    is evicted once `FASTQUERY_CACHE_MAX_ENTRIES` is reached.
+
+    Each entry records a version for every table the query tree reads,
+    so a write to any of them makes the entry stale without having to
+    find it. Tables that are only read in subqueries are not tracked.
+
+    Cached results are shared between requests: treat them as read-only.
+    """
+
+    # names of the settings that bound the cache
+    timeout_setting = 'FASTQUERY_CACHE_TIMEOUT'
+    max_entries_setting = 'FASTQUERY_CACHE_MAX_ENTRIES'
+
+    def __init__(self):
+        super(FastQueryCache, self).__init__()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires, tables, versions, data = entry
+            if (
+                expires is not None and expires <= time.monotonic()
+            ) or versions != self._get_versions(tables):
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return data
+
+    def set(self, key, tables, versions, data, timeout=None):
+        """Store `data`, unless `tables` changed since `versions`.
+
+        `versions` must be taken before the query runs, so that a write
+        that happens while it runs is not hidden by the new entry.
+        """
+        if timeout is None:
+            timeout = getattr(settings, self.timeout_setting)
+        expires = time.monotonic() + timeout if timeout is not None else None
+        max_entries = getattr(settings, self.max_entries_setting)
+
+        with self._lock:
+            if versions != self._get_versions(tables):
+                return
+
+            self._entries[key] = (expires, tables, versions, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+fastquery_cache = FastQueryCache()
+
+
+class CountCache(FastQueryCache):
+    """Process-wide LRU cache of exact query counts.
+
+    Used by the `cached` count strategy of `paginator.DynamicPaginator`.
+    Entries expire and are invalidated as in `FastQueryCache`.
+    """
+
+    timeout_setting = 'PAGINATION_COUNT_CACHE_TIMEOUT'
+    max_entries_setting = 'PAGINATION_COUNT_CACHE_MAX_ENTRIES'
+
+
+count_cache = CountCache()
+
+
+def get_size(value):
+    """Estimate the memory used by a serialized value, in bytes."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += get_size(key) + get_size(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += get_size(item)
+    return size
+
+
+class RepresentationCache(TableVersions):
+    """Process-wide LRU cache of serialized objects.
+
+    The cache is bounded by the estimated size of its entries (see
+    `REPRESENTATION_CACHE_MAX_BYTES`) rather than by their number.
+
+    Keys are built by the serializers and include version tokens (see
+    `WithDynamicSerializerMixin.get_representation_cache_key`), so
+    stale entries are never hit again and age out of the LRU.
+
+    Cached representations are shared between requests: treat them as
+    read-only.
+    """
+
+    def __init__(self):
+        super(RepresentationCache, self).__init__()
+        self._entries = OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, data):
+        max_bytes = settings.REPRESENTATION_CACHE_MAX_BYTES
+        size = get_size(data)
+        if size > max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[0]
+            self._entries[key] = (size, data)
+            self.size += size
+            while self.size > max_bytes:
+                _key, (old_size, _data) = self._entries.popitem(last=False)
+                self.size -= old_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+representation_cache = RepresentationCache()
+
+
+class FieldsCache(object):
+    """Process-wide cache of serializer field prototypes.
+
+    The fields of a serializer class are built once, frozen, and never
+    bound or handed out: serializers work on their own copies of them
+    (see `serializers.CopyOnWriteFields`), so no field state is shared
+    between serializers, requests or threads.
+    """
+
+    def __init__(self):
+        self._prototypes = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, cls, build):
+        """Get the prototypes of `cls`, calling `build()` on a miss."""
+        prototypes = self._prototypes.get(cls)
+        if prototypes is not None:
+            with self._lock:
+                self.hits += 1
+            return prototypes
+
+        # Build outside of the lock; if two threads race, the first
+        # result is kept and the other one is thrown away.
+        prototypes = MappingProxyType(dict(build()))
+        with self._lock:
+            self.misses += 1
+            return self._prototypes.setdefault(cls, prototypes)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._prototypes),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._prototypes.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+fields_cache = FieldsCache()
+
+
+def is_fields_cache_enabled(serializer):
+    """Whether per-class state can be shared by the instances of
+    `serializer` (a serializer or serializer class), i.e. whether its
+    fields are the same for every request (see `ENABLE_FIELDS_CACHE`).
+    """
+    return bool(
+        settings.ENABLE_FIELDS_CACHE and
+        getattr(serializer, 'ENABLE_FIELDS_CACHE', False)
+    )
+
+
+class FilterPlanCache(object):
+    """Process-wide LRU cache of compiled request filters.
+
+    Plans (see `filters.FilterPlan`) are keyed by serializer class and
+    filter shape, and hold no filter values, so they can be shared by
+    all requests.
+    """
+
+    def __init__(self):
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        """Get the plan of `key`, calling `build()` on a miss."""
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                self.hits += 1
+                return plan
+
+        # Build outside of the lock; if two threads race, the last
+        # result is kept.
+        plan = build()
+        max_size = settings.FILTER_PLAN_CACHE_SIZE
+        with self._lock:
+            self.misses += 1
+            if max_size:
+                self._plans[key] = plan
+                while len(self._plans) > max_size:
+                    self._plans.popitem(last=False)
+        return plan
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._plans),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+filter_plan_cache = FilterPlanCache()
+
+
+def _bump_versions(model):
+    fastquery_cache.invalidate(model)
+    count_cache.invalidate(model)
+    representation_cache.invalidate(model)
+
+
+def invalidate_model(model, using=None):
+    """Invalidate the cached queries, counts and representations that
+    read `model`'s tables.
+
+    Model signals call this for saves, deletes and m2m changes. Writes
+    that send no signals (`QuerySet.update()`, `bulk_create()`, raw SQL)
+    must call it themselves.
+
+    Versions are bumped right away, so that the writing transaction
+    doesn't read its own stale entries, and again once it commits: until
+    then, concurrent readers still see the old rows and may have cached
+    them under the new versions.
+    """
+    _bump_versions(model)
+    transaction.on_commit(lambda: _bump_versions(model), using=using)
+
+
+def _invalidate(sender, using=None, **kwargs):
+    invalidate_model(sender, using=using)
+
+
+def _invalidate_m2m(sender, instance, model, using=None, **kwargs):
+    # `sender` is the through model, `instance` and `model` the two sides.
+    for changed in (sender, instance.__class__, model):
+        invalidate_model(changed, using=using)
+
+
+post_save.connect(
+    _invalidate, dispatch_uid='dynamic_rest.caching.post_save'
+)
+post_delete.connect(
+    _invalidate, dispatch_uid='dynamic_rest.caching.post_delete'
+)
+m2m_changed.connect(
+    _invalidate_m2m, dispatch_uid='dynamic_rest.caching.m2m_changed'
+)
@@ -0,0 +1,115 @@
+"""This module contains column-at-a-time field converters.
+
+Each converter takes a field and a list of (non-None) values and returns
+the list of their representations, matching what the field's own
+`to_representation` would return for each value, but doing the
+per-field work (settings, timezone and format lookups) once per column.
+"""
+from enum import Enum
+
+from rest_framework import fields
+from rest_framework.settings import api_settings
+
+
+def convert_values(field, values):
+    return [field.to_representation(value) for value in values]
+
+
+def convert_strings(field, values):
+    return [str(value) for value in values]
+
+
+def convert_integers(field, values):
+    return [int(value) for value in values]
+
+
+def convert_floats(field, values):
+    return [float(value) for value in values]
+
+
+def convert_booleans(field, values):
+    return [
+        value if value is True or value is False
+        else field.to_representation(value)
+        for value in values
+    ]
+
+
+def convert_uuids(field, values):
+    if field.uuid_format == 'hex_verbose':
+        return [str(value) for value in values]
+    return [getattr(value, field.uuid_format) for value in values]
+
+
+def convert_choices(field, values):
+    choices = field.choice_strings_to_values
+    return [
+        field.to_representation(value)
+        if value == '' or isinstance(value, Enum)
+        else choices.get(str(value), value)
+        for value in values
+    ]
+
+
+def convert_datetimes(field, values):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if output_format is None or output_format.lower() != fields.ISO_8601:
+        return convert_values(field, values)
+
+    tz = (
+        field.timezone if hasattr(field, 'timezone')
+        else field.default_timezone()
+    )
+    result = []
+    for value in values:
+        if (
+            tz is None or
+            not value or
+            isinstance(value, str) or
+            value.tzinfo is None
+        ):
+            # unusual values, let the field deal with them
+            result.append(field.to_representation(value))
+            continue
+
+        if value.tzinfo is not tz:
+            try:
+                value = value.astimezone(tz)
+            except OverflowError:
+                field.fail('overflow')
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        result.append(value)
+    return result
+
+
+COLUMN_CONVERTERS = {
+    fields.CharField: convert_strings,
+    fields.IntegerField: convert_integers,
+    fields.FloatField: convert_floats,
+    fields.BooleanField: convert_booleans,
+    fields.UUIDField: convert_uuids,
+    fields.ChoiceField: convert_choices,
+    fields.DateTimeField: convert_datetimes,
+}
+_converters = {}
+
+
+def get_column_converter(field):
+    """Get the column converter of `field`.
+
+    Converters are looked up by the class that defines the field's
+    `to_representation`, so that fields which override it fall back
+    to calling it for every value.
+    """
+    field_class = field.__class__
+    converter = _converters.get(field_class)
+    if converter is None:
+        converter = convert_values
+        for cls in field_class.__mro__:
+            if 'to_representation' in cls.__dict__:
+                converter = COLUMN_CONVERTERS.get(cls, convert_values)
+                break
+        _converters[field_class] = converter
+    return converter
@@ -23,6 +23,17 @@ DYNAMIC_REST = {
     # are sideloaded repeatedly.
     'ENABLE_SERIALIZER_OBJECT_CACHE': True,
 
+    # ENABLE_REPRESENTATION_CACHE: enable/disable caching of serialized
+    # objects across requests, keyed by field selection and row version.
+    # Serializers whose output depends on the request (e.g. method fields
+    # that read `request.user`) should opt out with
+    # `ENABLE_REPRESENTATION_CACHE = False` on the class.
+    'ENABLE_REPRESENTATION_CACHE': False,
+
+    # REPRESENTATION_CACHE_MAX_BYTES: the approximate memory limit of the
+    # representation cache, per process.
+    'REPRESENTATION_CACHE_MAX_BYTES': 16 * 1024 * 1024,
+
     # ENABLE_SERIALIZER_OPTIMIZATIONS: enable/disable representation speedups
     'ENABLE_SERIALIZER_OPTIMIZATIONS': True,
 
@@ -60,10 +71,87 @@ DYNAMIC_REST = {
     # Can be overriden at the viewset level.
     'PAGE_SIZE_QUERY_PARAM': 'per_page',
 
+    # STREAM_CHUNK_SIZE: number of rows read (and prefetched) at a time
+    # when a list is streamed, see `FastQuery.iterator`.
+    'STREAM_CHUNK_SIZE': 2000,
+
+    # FASTQUERY_M2M_JOIN: prefetch many-to-many relations with a single
+    # query that joins the remote table to the through table, instead of
+    # fetching the join rows and the remote rows separately. This saves a
+    # round trip, but reads each remote row once per link, so it only pays
+    # off when latency dominates and remote rows are rarely shared.
+    'FASTQUERY_M2M_JOIN': False,
+
+    # FASTQUERY_COMPACT_ROWS: store FastQuery rows as `FastRow` objects
+    # (a list of values plus a column index shared by the query) instead
+    # of one `FastObject` dict per row. Uses less memory for large pages.
+    'FASTQUERY_COMPACT_ROWS': False,
+
+    # FASTQUERY_CACHE: cache the results of the root FastQuery built by
+    # FastDynamicFilterBackend across requests, see `caching.py`.
+    # Like the count and representation caches, entries are invalidated
+    # by model signals: `QuerySet.update()`, `bulk_create()` and raw SQL
+    # bypass them, so call `caching.invalidate_model()` after those.
+    'FASTQUERY_CACHE': False,
+
+    # FASTQUERY_CACHE_TIMEOUT: default lifetime of a cached FastQuery
+    # result, in seconds. None means entries never expire.
+    'FASTQUERY_CACHE_TIMEOUT': 60,
+
+    # FASTQUERY_CACHE_MAX_ENTRIES: number of cached FastQuery results
+    # kept before the least recently used one is evicted.
+    'FASTQUERY_CACHE_MAX_ENTRIES': 1000,
+
+    # FASTQUERY_PREFETCH_THREADS: size of the thread pool that runs sibling
+    # FastQuery prefetches concurrently, each on its own DB connection.
+    # 0 or 1 runs them one after another. Inside `atomic()` blocks they
+    # always run one after another.
+    'FASTQUERY_PREFETCH_THREADS': 0,
+
+    # FASTQUERY_IN_BATCH_SIZE: max number of IDs bound in one `IN (...)`
+    # filter when FastQuery prefetches related rows; larger ID sets are
+    # split across queries. On PostgreSQL the IDs are bound as a single
+    # array (`= ANY(%s)`) instead, so this doesn't apply.
+    'FASTQUERY_IN_BATCH_SIZE': 500,
+
     # EXCLUDE_COUNT_QUERY_PARAM: global setting for the query parameter
     # that disables counting during PageNumber pagination
     'EXCLUDE_COUNT_QUERY_PARAM': 'exclude_count',
 
+    # PAGINATION_COUNT_STRATEGY: how PageNumber pagination counts results
+    # (see `paginator.DynamicPaginator.count`):
+    # - 'exact': a COUNT(*) for every page.
+    # - 'cached': exact counts, cached per query until one of the tables
+    #   it reads is written (through model signals) or they time out.
+    # - 'estimated': the database's row estimate, for results estimated
+    #   at PAGINATION_COUNT_ESTIMATE_THRESHOLD rows or more (PostgreSQL
+    #   planner rows, or table statistics for unfiltered queries on
+    #   PostgreSQL and SQLite). Smaller results are counted exactly.
+    # `meta.count_strategy` tells which one produced `total_results`.
+    'PAGINATION_COUNT_STRATEGY': 'exact',
+
+    # PAGINATION_COUNT_CACHE_TIMEOUT: lifetime of a cached count, in
+    # seconds. None means entries never expire.
+    'PAGINATION_COUNT_CACHE_TIMEOUT': 60,
+
+    # PAGINATION_COUNT_CACHE_MAX_ENTRIES: number of cached counts kept
+    # before the least recently used one is evicted.
+    'PAGINATION_COUNT_CACHE_MAX_ENTRIES': 1000,
+
+    # PAGINATION_COUNT_ESTIMATE_THRESHOLD: the estimated number of rows
+    # above which the 'estimated' count strategy trusts the estimate.
+    'PAGINATION_COUNT_ESTIMATE_THRESHOLD': 100000,
+
+    # CURSOR_QUERY_PARAM: global setting for the query parameter that
+    # switches PageNumber pagination to cursor (keyset) mode. Pass it empty
+    # for the first page, then pass back `meta.next_cursor`.
+    'CURSOR_QUERY_PARAM': 'cursor',
+
+    # SIDELOADING_MAX_DEPTH: how many relations below the primary records
+    # the sideloading processor looks for records to sideload. Records
+    # nested deeper are left embedded. None means no limit.
+    'SIDELOADING_MAX_DEPTH': None,
+
     # ADDITIONAL_PRIMARY_RESOURCE_PREFIX: String to prefix additional
     # instances of the primary resource when sideloading.
     'ADDITIONAL_PRIMARY_RESOURCE_PREFIX': '+',
@@ -73,9 +161,35 @@ DYNAMIC_REST = {
     # path registered, links will default back to being resource-relative urls
     'ENABLE_HOST_RELATIVE_LINKS': True,
 
-    # Enables caching of serializer fields to speed up serializer usage
-    # Needs to also be configured on a per-serializer basis
-    'ENABLE_FIELDS_CACHE': False,
+    # Enables caching of serializer fields to speed up serializer usage.
+    # Fields are built once per serializer class and copied on first use.
+    # Serializers whose fields depend on the request or context should
+    # opt out with `ENABLE_FIELDS_CACHE = False` on the class.
+    'ENABLE_FIELDS_CACHE': True,
+
+    # SERIALIZER_PLAN_CACHE_SIZE: the maximum number of compiled field
+    # plans (see `serializers.SerializerPlan`) kept per process. Plans are
+    # keyed by the requested field shape, so this bounds the memory used
+    # by clients requesting many different shapes.
+    'SERIALIZER_PLAN_CACHE_SIZE': 1000,
+
+    # FILTER_PLAN_CACHE_SIZE: the maximum number of compiled request
+    # filters (see `filters.FilterPlan`) kept per process. Plans are keyed
+    # by serializer class and filter shape (keys, operators and complex
+    # filter structure, but not values). 0 disables the cache.
+    'FILTER_PLAN_CACHE_SIZE': 1000,
+
+    # FILTER_TO_MANY_WITH_EXISTS: apply filters on to-many relations
+    # (e.g. `filter{groups.name}` on users) in an EXISTS subquery instead
+    # of joining the relation, so that querysets don't need DISTINCT to
+    # remove the rows repeated by the join.
+    'FILTER_TO_MANY_WITH_EXISTS': True,
+
+    # FIELD_PATH_INDEX_MAX_DEPTH: how many fields deep API field paths
+    # (e.g. `created_by.first_name` is 2) are indexed per serializer class
+    # once resolved (see `paths.FieldPathIndex`). Deeper paths are
+    # resolved on every use.
+    'FIELD_PATH_INDEX_MAX_DEPTH': 3,
 
     # Enables use of hashid fields
     'ENABLE_HASHID_FIELDS': False,
@@ -106,7 +220,8 @@ class Settings(object):
 
     def _reload(self, value):
         """Reload settings after a change."""
-        self.settings = value
+        # `value` is None when an override of an unset setting is removed.
+        self.settings = value or {}
         self._cache = {}
 
     def _load_class(self, attr, val):
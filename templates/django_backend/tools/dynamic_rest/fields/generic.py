@@ -5,7 +5,7 @@ from rest_framework.exceptions import ValidationError
 from tools.dynamic_rest.fields.common import WithRelationalFieldMixin
 from tools.dynamic_rest.fields.fields import DynamicField
 from tools.dynamic_rest.routers import DynamicRouter
-from tools.dynamic_rest.tagged import TaggedDict
+from tools.dynamic_rest.tagged import get_tags
 
 
 class DynamicGenericRelationField(
@@ -102,10 +102,11 @@ class DynamicGenericRelationField(
                 instance
             )
 
-            # Pass pk object that contains type and ID to TaggedDict object
+            # Pass pk object that contains type and ID to the tag
             # so that Processor can use it when the field gets sideloaded.
-            if isinstance(r, TaggedDict):
-                r.pk_value = pk_value
+            tag = get_tags(self.context).get(r)
+            if tag is not None:
+                tag.pk_value = pk_value
             return r
         except BaseException:
             # This feature should be considered to be in Beta so don't break
@@ -2,12 +2,12 @@
 
 from django.core.exceptions import ValidationError as InternalValidationError
 from django.core.exceptions import ImproperlyConfigured
-from django.db.models import Q, Prefetch, Manager
+from django.db.models import Exists, OuterRef, Q, Prefetch, Manager
 import six
 from functools import reduce
 from rest_framework import __version__ as drf_version
 from rest_framework import serializers
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import APIException, ValidationError
 try:
     from rest_framework.fields import BooleanField, NullBooleanField
 except ImportError:
@@ -15,6 +15,11 @@ except ImportError:
     from rest_framework.fields import BooleanField
 from rest_framework.filters import BaseFilterBackend, OrderingFilter
 
+from tools.dynamic_rest.bases import DynamicSerializerBase
+from tools.dynamic_rest.caching import (
+    filter_plan_cache,
+    is_fields_cache_enabled,
+)
 from tools.dynamic_rest.utils import is_truthy
 from tools.dynamic_rest.conf import settings
 from tools.dynamic_rest.datastructures import TreeMap
@@ -24,8 +29,11 @@ from tools.dynamic_rest.meta import (
     is_field_remote,
     is_model_field,
     get_related_model,
+    is_multivalued_join,
+    is_multivalued_lookup,
 )
 from tools.dynamic_rest.patches import patch_prefetch_one_level
+from tools.dynamic_rest.paths import get_field_path, get_field_path_index
 from tools.dynamic_rest.prefetch import FastQuery, FastPrefetch
 from tools.dynamic_rest.related import RelatedObject
 
@@ -59,6 +67,29 @@ def has_joins(queryset):
     return False
 
 
+def has_multivalued_joins(queryset):
+    """Return True iff. a queryset includes to-many joins.
+
+    Only these can make the queryset return duplicate results.
+    """
+    return any(
+        is_multivalued_join(join)
+        for join in six.itervalues(queryset.query.alias_map)
+    )
+
+
+def get_filter_error(e):
+    """Convert an error raised by Django while applying filters into a
+    ValidationError, so that bad queries are 400s rather than 500s."""
+    if isinstance(e, InternalValidationError):
+        return ValidationError(
+            dict(e) if hasattr(e, 'error_dict') else list(e)
+        )
+    # Some other Django error in parsing the filter.
+    # Very likely a bad query, so throw a ValidationError.
+    return ValidationError(getattr(e, 'message', ''))
+
+
 class FilterNode(object):
     def __init__(self, field, operator, value):
         """Create an object representing a filter, to be stored in a TreeMap.
@@ -106,6 +137,14 @@ class FilterNode(object):
         Returns:
             A filter key.
         """
+        path = get_field_path(serializer, self.field)
+        if path is not None and path.filterable:
+            key = path.filter_lookup
+            if self.operator:
+                key = '%s__%s' % (key, self.operator)
+            return (key, path.field)
+
+        # Not indexed (see `paths.FieldPathIndex`), walk the path.
         rewritten = []
         last = len(self.field) - 1
         s = serializer
@@ -167,10 +206,10 @@ def rewrite_filters(fs, serializer):
     return out
 
 
-def clause_to_q(clause, serializer):
-    key, value = clause
+def compile_clause(key, serializer):
+    """Get the query key of a complex filter clause, and whether
+    the clause is negated."""
     negate = False
-    q = {}
     if key.startswith('-'):
         negate = True
         key = key[1:]
@@ -180,14 +219,221 @@ def clause_to_q(clause, serializer):
         operator = parts.pop()
     if operator == 'eq':
         operator = None
-    node = FilterNode(parts, operator, value)
+    node = FilterNode(parts, operator, None)
     key, _ = node.generate_query_key(serializer)
-    q = Q(**{key: node.value})
+    return key, negate
+
+
+def clause_to_q(clause, serializer):
+    key, value = clause
+    key, negate = compile_clause(key, serializer)
+    q = Q(**{key: value})
     if negate:
         q = ~q
     return q
 
 
+def get_complex_ops(filters):
+    """Get the or/and operands of a complex filter, if any."""
+    ors = filters.get('.or') or filters.get('$or')
+    if ors:
+        return OR, ors
+    ands = filters.get('.and') or filters.get('$and')
+    if ands:
+        return AND, ands
+    return None, None
+
+
+class FilterPlan(object):
+    """The filters of one level of a request, compiled for a serializer.
+
+    Everything but the filter values is worked out once per serializer
+    class and filter shape (see `get_shape`): the query keys of the
+    filtered fields, which values are coerced to booleans, and the
+    structure of complex filters. Requests then only bind their values,
+    see `to_query`.
+
+    Filters on to-many relations (e.g. `filter{groups.name}` on users)
+    are applied in an `Exists()` subquery, so that they don't join the
+    relation and repeat rows (see `FILTER_TO_MANY_WITH_EXISTS`).
+    """
+
+    def __init__(self, filters, serializer):
+        get_model = getattr(serializer, 'get_model', None)
+        self.model = get_model() if get_model else None
+        self.multivalued_includes = frozenset()
+        self.complex_is_multivalued = False
+
+        complex_filters = filters.get('_complex')
+        if complex_filters:
+            self.complex = self._compile_complex(complex_filters, serializer)
+            self.includes = self.excludes = ()
+            self.complex_is_multivalued = any(
+                self._is_multivalued(query_key)
+                for query_key in self._get_complex_includes(self.complex)
+            )
+        else:
+            self.complex = None
+            self.includes = self._compile_nodes(
+                filters.get('_include'), serializer
+            )
+            self.excludes = self._compile_nodes(
+                filters.get('_exclude'), serializer
+            )
+            self.multivalued_includes = frozenset(
+                query_key for _, query_key, _ in self.includes
+                if self._is_multivalued(query_key)
+            )
+
+    @classmethod
+    def get_shape(cls, filters):
+        """Get the hashable shape of a filter tree level.
+
+        Filter node keys include their operator, and complex filters
+        are described down to their clause keys.
+        """
+        complex_filters = filters.get('_complex')
+        if complex_filters:
+            return ('complex', cls._get_complex_shape(complex_filters))
+        return (
+            'simple',
+            tuple(filters.get('_include') or ()),
+            tuple(filters.get('_exclude') or ()),
+        )
+
+    @classmethod
+    def _get_complex_shape(cls, filters):
+        if not filters:
+            return None
+        op, operands = get_complex_ops(filters)
+        if op is not None:
+            return (op.__name__, tuple(
+                cls._get_complex_shape(f) for f in operands
+            ))
+        return ('clauses', tuple(filters))
+
+    @staticmethod
+    def _compile_nodes(nodes, serializer):
+        compiled = []
+        for node_key, node in six.iteritems(nodes or {}):
+            query_key, field = node.generate_query_key(serializer)
+            compiled.append(
+                (node_key, query_key, isinstance(field, DRF_BOOLEAN_FIELD))
+            )
+        return tuple(compiled)
+
+    def _is_multivalued(self, query_key):
+        return (
+            self.model is not None and
+            is_multivalued_lookup(self.model, query_key)
+        )
+
+    @classmethod
+    def _get_complex_includes(cls, compiled):
+        """Get the query keys of the clauses of a complex filter that
+        are not negated.
+
+        Django already applies negated to-many clauses in a subquery.
+        """
+        if compiled is None:
+            return
+        op, parts = compiled
+        if op is not None:
+            for part in parts:
+                for query_key in cls._get_complex_includes(part):
+                    yield query_key
+            return
+        for _key, query_key, negate in parts:
+            if not negate:
+                yield query_key
+
+    def _compile_complex(self, filters, serializer):
+        if not filters:
+            return None
+        op, operands = get_complex_ops(filters)
+        if op is not None:
+            return (op, tuple(
+                self._compile_complex(f, serializer) for f in operands
+            ))
+        return (None, tuple(
+            (key,) + compile_clause(key, serializer) for key in filters
+        ))
+
+    @staticmethod
+    def _bind_nodes(compiled, nodes):
+        out = {}
+        for node_key, query_key, boolean in compiled:
+            value = nodes[node_key].value
+            out[query_key] = is_truthy(value) if boolean else value
+        return out
+
+    def _bind_complex(self, compiled, filters):
+        if compiled is None:
+            return None
+        op, parts = compiled
+        if op is not None:
+            _, operands = get_complex_ops(filters)
+            return reduce(op, [
+                self._bind_complex(part, f)
+                for part, f in zip(parts, operands)
+            ])
+        clauses = []
+        for key, query_key, negate in parts:
+            q = Q(**{query_key: filters[key]})
+            clauses.append(~q if negate else q)
+        return reduce(AND, clauses) if clauses else Q()
+
+    def to_query(self, filters, q=None):
+        """Bind the values of `filters`, which must have this plan's
+        shape.
+
+        Returns:
+          Q() instance or None if no inclusion or exclusion filters
+          were specified.
+        """
+        exists = settings.FILTER_TO_MANY_WITH_EXISTS
+        if self.complex is not None:
+            q = self._bind_complex(self.complex, filters['_complex'])
+            if exists and q is not None and self.complex_is_multivalued:
+                q = self._exists(q)
+            return q
+
+        if not self.includes and not self.excludes:
+            return None
+
+        q = q or Q()
+        if self.includes:
+            includes = self._bind_nodes(self.includes, filters['_include'])
+            if exists and self.multivalued_includes:
+                # All to-many filters go in the same subquery: as in a
+                # single `filter()` call, they must match the same
+                # related rows.
+                multivalued = {
+                    k: includes.pop(k) for k in self.multivalued_includes
+                }
+                if includes:
+                    q &= Q(**includes)
+                q &= self._exists(Q(**multivalued))
+            else:
+                q &= Q(**includes)
+        if self.excludes:
+            excludes = self._bind_nodes(self.excludes, filters['_exclude'])
+            for k, v in six.iteritems(excludes):
+                q &= ~Q(**{k: v})
+        return q
+
+    def _exists(self, q):
+        """Get a filter for the rows that have a match for `q` in the
+        subquery of their own pk."""
+        try:
+            subquery = self.model._base_manager.filter(q, pk=OuterRef('pk'))
+        except APIException:
+            raise
+        except Exception as e:
+            raise get_filter_error(e)
+        return Q(Exists(subquery))
+
+
 class DynamicFilterBackend(BaseFilterBackend):
 
     """A DRF filter backend that constructs DREST querysets.
@@ -344,46 +590,22 @@ class DynamicFilterBackend(BaseFilterBackend):
           Q() instance or None if no inclusion or exclusion filters
           were specified.
         """
+        if not filters:
+            return None
+        return self._get_filter_plan(filters, serializer).to_query(filters, q)
 
-        if (
-            not filters.get('_complex')
-        ):
-            includes = filters.get('_include')
-            excludes = filters.get('_exclude')
-            q = q or Q()
-
-            if not includes and not excludes:
-                return None
+    def _get_filter_plan(self, filters, serializer):
+        """Get the compiled `FilterPlan` of `filters`.
 
-            if includes:
-                includes = rewrite_filters(includes, serializer)
-                q &= Q(**includes)
-            if excludes:
-                excludes = rewrite_filters(excludes, serializer)
-                for k, v in six.iteritems(excludes):
-                    q &= ~Q(**{k: v})
-            return q
-        else:
-            filters = filters.get('_complex')
-            ors = filters.get('.or') or filters.get('$or')
-            ands = filters.get('.and') or filters.get('$and')
-            if q is None:
-                q = Q()
-            if ors:
-                result = reduce(
-                    OR,
-                    [self._filters_to_query({"_complex": f}, serializer) for f in ors]
-                )
-                return result
-            if ands:
-                return reduce(
-                    AND,
-                    [self._filters_to_query({"_complex": f}, serializer) for f in ands]
-                )
-            clauses = [
-                clause_to_q(clause, serializer) for clause in filters.items()
-            ]
-            return reduce(AND, clauses) if clauses else q
+        Plans are cached by serializer class, unless the serializer's
+        fields can vary by request (see `ENABLE_FIELDS_CACHE`).
+        """
+        if not is_fields_cache_enabled(serializer):
+            return FilterPlan(filters, serializer)
+        return filter_plan_cache.get(
+            (serializer.__class__, FilterPlan.get_shape(filters)),
+            lambda: FilterPlan(filters, serializer)
+        )
 
     def _create_prefetch(self, source, queryset):
         return Prefetch(source, queryset=queryset)
@@ -424,6 +646,16 @@ class DynamicFilterBackend(BaseFilterBackend):
             queryset._using_prefetches = prefetches
         return queryset
 
+    @staticmethod
+    def _is_prefetchable_serializer(field):
+        """Return True if `field` is a serializer backed by a model."""
+        if isinstance(field, serializers.ModelSerializer):
+            return True
+        return (
+            isinstance(field, DynamicSerializerBase) and
+            field.get_model() is not None
+        )
+
     def _build_requested_prefetches(
         self, prefetches, requirements, model, fields, filters
     ):
@@ -435,7 +667,7 @@ class DynamicFilterBackend(BaseFilterBackend):
                 field = field.serializer
             if isinstance(field, serializers.ListSerializer):
                 field = field.child
-            if not isinstance(field, serializers.ModelSerializer):
+            if not self._is_prefetchable_serializer(field):
                 continue
 
             source = field.source or name
@@ -608,13 +840,8 @@ class DynamicFilterBackend(BaseFilterBackend):
             # from 500 status code to 400.
             try:
                 queryset = queryset.filter(query)
-            except InternalValidationError as e:
-                raise ValidationError(dict(e) if hasattr(e, 'error_dict') else list(e))
             except Exception as e:
-                # Some other Django error in parsing the filter.
-                # Very likely a bad query, so throw a ValidationError.
-                err_msg = getattr(e, 'message', '')
-                raise ValidationError(err_msg)
+                raise get_filter_error(e)
 
         # A serializer can have this optional function
         # to dynamically apply additional filters on
@@ -631,7 +858,7 @@ class DynamicFilterBackend(BaseFilterBackend):
             queryset = queryset.prefetch_related(*prefetch)
         elif isinstance(queryset, Manager):
             queryset = queryset.all()
-        if has_joins(queryset) or not is_root_level:
+        if has_multivalued_joins(queryset) or not is_root_level:
             queryset = queryset.distinct()
 
         if self.DEBUG:
@@ -657,6 +884,15 @@ class FastDynamicFilterBackend(DynamicFilterBackend):
         queryset = super(FastDynamicFilterBackend, self)._make_model_queryset(model)
         return FastQuery(queryset)
 
+    def filter_queryset(self, request, queryset, view):
+        queryset = super(FastDynamicFilterBackend, self).filter_queryset(
+            request, queryset, view
+        )
+        # Only the root query is cached: its entry covers the prefetches.
+        if settings.FASTQUERY_CACHE and isinstance(queryset, FastQuery):
+            queryset = queryset.cache()
+        return queryset
+
     def _serializer_filter(self, serializer=None, queryset=None):
         queryset.queryset = serializer.filter_queryset(queryset.queryset)
         return queryset
@@ -681,9 +917,12 @@ class DynamicSortingFilter(OrderingFilter):
         ordering = self.get_ordering(request, queryset, view)
         if ordering:
             queryset = queryset.order_by(*ordering)
-            if any(['__' in o for o in ordering]):
+            model = queryset.model
+            if any(
+                is_multivalued_lookup(model, o.lstrip('-')) for o in ordering
+            ):
                 # add distinct() to remove duplicates
-                # in case of order-by-related
+                # in case of order-by-related (to-many)
                 queryset = queryset.distinct()
         return queryset
 
@@ -745,8 +984,17 @@ class DynamicSortingFilter(OrderingFilter):
         if not self._is_allowed_term(term, view):
             return None
 
-        serializer = self._get_serializer_class(view)()
+        serializer_class = self._get_serializer_class(view)
         serializer_chain = term.split('.')
+        if is_fields_cache_enabled(serializer_class):
+            path = get_field_path_index(serializer_class).get(
+                serializer_chain
+            )
+            if path is not None and path.sortable:
+                return path.sort_lookup
+
+        # Not indexed (see `paths.FieldPathIndex`), walk the path.
+        serializer = serializer_class()
 
         model_chain = []
 
@@ -3,6 +3,88 @@ import six
 from tools.dynamic_rest.conf import settings
 from tools.dynamic_rest.routers import DynamicRouter
 
+# query parameter that switches a response to links by convention
+LINKS_BY_CONVENTION_PARAM = 'links_by_convention'
+# key of the link templates in serializer contexts
+LINK_TEMPLATES_CONTEXT_KEY = '_dynamic_rest_link_templates'
+# placeholder for the record's pk in link templates
+PK_PLACEHOLDER = '{pk}'
+
+
+class LinkTemplate(object):
+    """The links of a serializer's records, compiled once per serializer.
+
+    Relation endpoints hang off the record's canonical path, so their
+    URLs are laid out around the pk ahead of time, e.g.
+    `/examples/{pk}/created_by/`, leaving one substitution per record.
+    Callable links are still called for every record.
+
+    By convention (see `LINKS_BY_CONVENTION_PARAM`), the templates are
+    sent once per response instead, in `templates`, and only callable
+    links are added to the records.
+    """
+
+    def __init__(self, serializer, by_convention=False):
+        base_path = None
+        if settings.ENABLE_HOST_RELATIVE_LINKS:
+            # if the resource isn't registered, this will default back to
+            # using resource-relative urls for links.
+            base_path = DynamicRouter.get_canonical_path(
+                serializer.get_resource_key()
+            )
+
+        # record path, formatted with the pk
+        self.path = base_path.replace('%', '%%') + '/%s/' if base_path else ''
+        # (name, URL, whether the URL is relative to the record's path,
+        # field), where the URL is a callable if `field` is set
+        self.links = []
+        # name -> URL template, for links by convention
+        self.templates = {}
+
+        for name, field in six.iteritems(serializer.get_link_fields()):
+            link = getattr(field, 'link', None)
+            if callable(link):
+                self.links.append((name, link, False, field))
+                continue
+
+            # Default to DREST-generated relation endpoints.
+            relative = link is None
+            url = '%s/' % name if relative else link
+            if not by_convention:
+                self.links.append((name, url, relative, None))
+            elif relative and base_path:
+                self.templates[name] = '%s/%s/%s' % (
+                    base_path, PK_PLACEHOLDER, url
+                )
+            else:
+                self.templates[name] = url
+
+    def get_links(self, data, instance):
+        """Get the link object of a record."""
+        links = {}
+        path = self.path % (instance.pk,) if self.path else ''
+        for name, url, relative, field in self.links:
+            # For included fields, omit link if there's no data.
+            if name in data and not data[name]:
+                continue
+            if field is not None:
+                links[name] = url(name, field, data, instance)
+            else:
+                links[name] = path + url if relative else url
+        return links
+
+
+def get_link_templates(context):
+    """Get the link templates of a serializer context, by resource name.
+
+    Serializers add their templates as they render records
+    by convention.
+    """
+    templates = context.get(LINK_TEMPLATES_CONTEXT_KEY)
+    if templates is None:
+        templates = context[LINK_TEMPLATES_CONTEXT_KEY] = {}
+    return templates
+
 
 def merge_link_object(serializer, data, instance):
     """Add a 'links' attribute to the data that maps field names to URLs.
@@ -11,37 +93,13 @@ def merge_link_object(serializer, data, instance):
           implementations are possible to support other formats.
     """
 
-    link_object = {}
-
     if not getattr(instance, 'pk', None):
         # If instance doesn't have a `pk` field, we'll assume it doesn't
         # have a canonical resource URL to hang a link off of.
         # This generally only affectes Ephemeral Objects.
         return data
 
-    link_fields = serializer.get_link_fields()
-    for name, field in six.iteritems(link_fields):
-        # For included fields, omit link if there's no data.
-        if name in data and not data[name]:
-            continue
-
-        link = getattr(field, 'link', None)
-        if link is None:
-            base_url = ''
-            if settings.ENABLE_HOST_RELATIVE_LINKS:
-                # if the resource isn't registered, this will default back to
-                # using resource-relative urls for links.
-                base_url = DynamicRouter.get_canonical_path(
-                    serializer.get_resource_key(),
-                    instance.pk
-                ) or ''
-            link = '%s%s/' % (base_url, name)
-        # Default to DREST-generated relation endpoints.
-        elif callable(link):
-            link = link(name, field, data, instance)
-
-        link_object[name] = link
-
+    link_object = serializer.get_link_template().get_links(data, instance)
     if link_object:
         data['links'] = link_object
     return data
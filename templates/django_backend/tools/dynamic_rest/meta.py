@@ -1,6 +1,9 @@
 """Module containing Django meta helpers."""
 from itertools import chain
 
+from django.core.exceptions import FieldError
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.sql.query import Query
 from django.db.models import ManyToOneRel  # tested in 1.9
 from django.db.models import OneToOneRel  # tested in 1.9
 from django.db.models import (
@@ -73,6 +76,74 @@ def get_model_field(model, field_name):
             )
 
 
+def is_multivalued_lookup(model, lookup):
+    """Check whether an ORM lookup follows a to-many relation.
+
+    Filtering or sorting on such a lookup (e.g. `groups__name__in` on
+    users) joins the relation, which can repeat rows.
+
+    Arguments:
+        model: a Django model
+        lookup: an ORM lookup, possibly ending with a lookup type
+
+    Returns:
+        True if `lookup` goes through a to-many relation, False otherwise
+            (including if it is invalid).
+    """
+    try:
+        path = Query(model).names_to_path(
+            lookup.split(LOOKUP_SEP),
+            model._meta,
+            allow_many=True,
+            fail_on_missing=False
+        )[0]
+    except FieldError:
+        return False
+    return any(path_info.m2m for path_info in path)
+
+
+def is_nullable_lookup(model, lookup):
+    """Check whether an ORM lookup can be NULL.
+
+    This is the case for nullable fields, and for any field across a
+    nullable or reverse relation, where the related row may not exist.
+
+    Arguments:
+        model: a Django model
+        lookup: an ORM lookup
+
+    Returns:
+        True if `lookup` can be NULL (or is invalid), False otherwise.
+    """
+    try:
+        path, final_field, _targets, _rest = Query(model).names_to_path(
+            lookup.split(LOOKUP_SEP),
+            model._meta,
+            allow_many=True,
+            fail_on_missing=False
+        )
+    except FieldError:
+        return True
+    for path_info in path:
+        if (
+            not path_info.direct or
+            path_info.m2m or
+            getattr(path_info.join_field, 'null', True)
+        ):
+            return True
+    return bool(getattr(final_field, 'null', True))
+
+
+def is_multivalued_join(join):
+    """Check whether a query join (an entry of `Query.alias_map`) can
+    repeat the rows of its parent."""
+    join_field = getattr(join, 'join_field', None)
+    if join_field is None:
+        # not a join, or an unknown kind of join
+        return bool(getattr(join, 'join_type', None))
+    return bool(join_field.one_to_many or join_field.many_to_many)
+
+
 def get_model_field_and_type(model, field_name):
     field = get_model_field(model, field_name)
 
@@ -11,6 +11,7 @@ from rest_framework.metadata import SimpleMetadata
 from rest_framework.serializers import ListSerializer, ModelSerializer
 
 from tools.dynamic_rest.fields import DynamicRelationField
+from tools.dynamic_rest.paths import get_field_path
 
 
 class DynamicMetadata(SimpleMetadata):
@@ -38,8 +39,23 @@ class DynamicMetadata(SimpleMetadata):
             if hasattr(serializer, 'get_plural_name'):
                 metadata['resource_name_plural'] = serializer.get_plural_name()
         metadata['properties'] = self.get_serializer_info(serializer)
+        self.add_field_path_info(metadata['properties'], serializer, view)
         return metadata
 
+    def add_field_path_info(self, properties, serializer, view):
+        """Adds `filterable` and `sortable` to the properties of indexed
+        serializers (see `paths.FieldPathIndex`)."""
+        ordering_fields = getattr(view, 'ordering_fields', None)
+        all_sortable = ordering_fields is None or ordering_fields == '__all__'
+        for name, field_info in properties.items():
+            path = get_field_path(serializer, (name,))
+            if path is None:
+                continue
+            field_info['filterable'] = path.filterable
+            field_info['sortable'] = path.sortable and (
+                all_sortable or name in ordering_fields
+            )
+
     def get_field_info(self, field):
         """Adds `related_to` and `nullable` to the metadata response."""
         field_info = OrderedDict()
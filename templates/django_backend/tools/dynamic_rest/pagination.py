@@ -21,22 +21,37 @@ class DynamicPageNumberPagination(PageNumberPagination):
 
     page_size_query_param = settings.PAGE_SIZE_QUERY_PARAM
     exclude_count_query_param = settings.EXCLUDE_COUNT_QUERY_PARAM
+    cursor_query_param = settings.CURSOR_QUERY_PARAM
+    next_cursor = None
+    previous_cursor = None
     page_query_param = settings.PAGE_QUERY_PARAM
     max_page_size = settings.MAX_PAGE_SIZE
     page_size = settings.PAGE_SIZE or api_settings.PAGE_SIZE
+    count_strategy = settings.PAGINATION_COUNT_STRATEGY
     django_paginator_class = DynamicPaginator
 
     def get_page_metadata(self):
         # always returns page, per_page
         # also returns total_results and total_pages
         # (unless EXCLUDE_COUNT_QUERY_PARAM is set)
+        if self.cursor is not None:
+            # cursor mode: no page number and no counts
+            return {
+                'per_page': self.get_page_size(self.request),
+                'next_cursor': self.next_cursor,
+                'previous_cursor': self.previous_cursor,
+                'more_pages': self.next_cursor is not None,
+            }
+
         meta = {
             'page': self.page.number,
             'per_page': self.get_page_size(self.request)
         }
         if not self.exclude_count:
-            meta['total_results'] = self.page.paginator.count
-            meta['total_pages'] = self.page.paginator.num_pages
+            paginator = self.page.paginator
+            meta['total_results'] = paginator.count
+            meta['total_pages'] = paginator.num_pages
+            meta['count_strategy'] = paginator.count_strategy_used
         else:
             meta['more_pages'] = self.more_pages
         return meta
@@ -46,7 +61,7 @@ class DynamicPageNumberPagination(PageNumberPagination):
         result = None
         if isinstance(data, list):
             result = OrderedDict()
-            if not self.exclude_count:
+            if not self.exclude_count and self.cursor is None:
                 result['count'] = self.page.paginator.count
                 result['next'] = self.get_next_link()
                 result['previous'] = self.get_previous_link()
@@ -64,27 +79,43 @@ class DynamicPageNumberPagination(PageNumberPagination):
     def exclude_count(self):
         return self.request.query_params.get(self.exclude_count_query_param)
 
+    @cached_property
+    def cursor(self):
+        # None unless cursor mode is requested, '' for the first page
+        return self.request.query_params.get(self.cursor_query_param)
+
     def get_page_number(self, request, paginator):
         page_number = request.query_params.get(self.page_query_param, 1)
         if page_number in self.last_page_strings:
             page_number = paginator.num_pages
         return page_number
 
-    def paginate_queryset(self, queryset, request, **other):
+    def paginate_queryset(self, queryset, request, lazy=False, **other):
         """
         Paginate a queryset if required, either returning a
         page object, or `None` if pagination is not configured for this view.
+
+        If `lazy` is True, the page's queryset is returned unevaluated
+        (cursor pages excepted). It may hold one extra object, which
+        must be dropped; call `end_lazy_page` once it has been read.
         """
         if 'exclude_count' in self.__dict__:
             self.__dict__.pop('exclude_count')
+        self.__dict__.pop('cursor', None)
 
         page_size = self.get_page_size(request)
         if not page_size:
             return None
 
         self.request = request
+        if self.cursor is not None:
+            return self.paginate_queryset_by_cursor(queryset, page_size)
+
         paginator = self.django_paginator_class(
-            queryset, page_size, exclude_count=self.exclude_count
+            queryset,
+            page_size,
+            exclude_count=self.exclude_count,
+            count_strategy=self.count_strategy,
         )
         page_number = self.get_page_number(request, paginator)
 
@@ -100,6 +131,9 @@ class DynamicPageNumberPagination(PageNumberPagination):
             # The browsable API should display pagination controls.
             self.display_page_controls = True
 
+        if lazy:
+            return self.page.object_list
+
         result = list(self.page)
         if self.exclude_count:
             if len(result) > page_size:
@@ -109,3 +143,37 @@ class DynamicPageNumberPagination(PageNumberPagination):
             else:
                 self.more_pages = False
         return result
+
+    def end_lazy_page(self, count):
+        """Finish a lazy page after reading `count` objects from it."""
+        if self.exclude_count and self.cursor is None:
+            self.more_pages = count > self.get_page_size(self.request)
+
+    def paginate_queryset_by_cursor(self, queryset, page_size):
+        """Paginate by sort key (see `DynamicPaginator.seek`)."""
+        paginator = self.django_paginator_class(
+            queryset, page_size, exclude_count=True
+        )
+        try:
+            result, self.next_cursor, self.previous_cursor = paginator.seek(
+                self.cursor
+            )
+        except InvalidPage as exc:
+            raise NotFound(str(exc))
+        return result
+
+
+class DynamicCursorPagination(DynamicPageNumberPagination):
+    """Cursor (keyset) pagination.
+
+    Pages are always read by sort key, as in the cursor mode of
+    `DynamicPageNumberPagination`, and never counted: a deep page costs
+    the same as the first one. Without a cursor, the first page is
+    returned. Pages follow the view's ordering (e.g. `sort[]`), with the
+    pk as a tiebreaker, and `meta` holds the opaque cursors of the next
+    and previous pages.
+    """
+
+    @cached_property
+    def cursor(self):
+        return self.request.query_params.get(self.cursor_query_param) or ''
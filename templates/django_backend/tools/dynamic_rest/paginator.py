@@ -1,13 +1,36 @@
 # adapted from Django's django.core.paginator (2.2 - 3.2+ compatible)
 # adds support for the "exclude_count" parameter
 
+import base64
+import binascii
+import datetime
+import json
+from functools import reduce
 from math import ceil
+from operator import or_
 
 import inspect
+from django.core.exceptions import (
+    EmptyResultSet,
+    FieldDoesNotExist,
+    ValidationError,
+)
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connections, transaction
+from django.db.models import F, Q
 from django.utils.functional import cached_property
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+from django.core.paginator import (
+    InvalidPage,
+    Paginator,
+    PageNotAnInteger,
+    EmptyPage,
+)
 from django.utils.inspect import method_has_no_args
 
+from tools.dynamic_rest.caching import count_cache
+from tools.dynamic_rest.conf import settings
+from tools.dynamic_rest.meta import is_multivalued_lookup, is_nullable_lookup
+
 try:
     from django.utils.translation import gettext_lazy as _
 except ImportError:
@@ -15,12 +38,341 @@ except ImportError:
         return x
 
 
+class InvalidCursor(InvalidPage):
+    pass
+
+
+# count strategies, see `DynamicPaginator.count`
+COUNT_EXACT = 'exact'
+COUNT_CACHED = 'cached'
+COUNT_ESTIMATED = 'estimated'
+
+
+def get_seek_ordering(queryset):
+    """Get the ordering of `queryset` as a list of (path, descending).
+
+    The pk is appended unless it's already there, so that the ordering
+    is total and every row has a distinct sort key. Orderings across
+    to-many relations are rejected: rows don't have a single sort key.
+    """
+    query = queryset.query
+    if query.order_by:
+        ordering = query.order_by
+    elif query.default_ordering:
+        ordering = query.get_meta().ordering
+    else:
+        ordering = ()
+
+    meta = queryset.model._meta
+    pk_names = {'pk', meta.pk.name, meta.pk.attname}
+    seek_ordering = []
+    for term in ordering:
+        if not isinstance(term, str) or term == '?':
+            raise InvalidCursor(
+                _('Cursor pagination requires ordering by field names')
+            )
+        path = term.lstrip('-')
+        if is_multivalued_lookup(queryset.model, path):
+            raise InvalidCursor(
+                _('Cursor pagination can\'t order by to-many relations')
+            )
+        seek_ordering.append((path, term.startswith('-')))
+        if path in pk_names:
+            break
+    else:
+        seek_ordering.append(('pk', False))
+    return seek_ordering
+
+
+def get_nullable_paths(model, ordering):
+    """Get the paths of `ordering` whose values can be NULL."""
+    return frozenset(
+        path for path, _desc in ordering if is_nullable_lookup(model, path)
+    )
+
+
+def get_seek_order_by(ordering, nullable=()):
+    """Get the `order_by()` terms of `ordering`.
+
+    NULLs sort after every value, as they do by default in PostgreSQL.
+    The position of NULLs in the `nullable` paths is made explicit so
+    that it doesn't depend on the database.
+    """
+    order_by = []
+    for path, desc in ordering:
+        if path in nullable:
+            order_by.append(
+                F(path).desc(nulls_first=True) if desc
+                else F(path).asc(nulls_last=True)
+            )
+        else:
+            order_by.append('-' + path if desc else path)
+    return order_by
+
+
+def get_reverse_seek_ordering(ordering):
+    return [(path, not desc) for path, desc in ordering]
+
+
+def get_seek_after(path, desc, value, nullable, inclusive=False):
+    """Get a filter for the values of `path` after `value`, or None if
+    there are none.
+
+    NULLs come after every value, see `get_seek_order_by`.
+    """
+    if value is None:
+        if inclusive:
+            # NULLs, and in descending order every value
+            return Q() if desc else Q(**{'%s__isnull' % path: True})
+        return Q(**{'%s__isnull' % path: False}) if desc else None
+
+    lookup = 'lt' if desc else 'gt'
+    if inclusive:
+        lookup += 'e'
+    after = Q(**{'%s__%s' % (path, lookup): value})
+    if nullable and not desc:
+        after |= Q(**{'%s__isnull' % path: True})
+    return after
+
+
+def get_seek_filter(ordering, key, nullable=()):
+    """Get a filter for the rows that come after `key` in `ordering`.
+
+    For `[(a, False), (b, True)]` and `key=(x, y)` this is
+    `a >= x AND (a > x OR (a = x AND b < y))`. The redundant leading
+    range lets the database seek on an index of the first column.
+
+    Only the `nullable` paths (see `get_nullable_paths`) can have NULLs
+    in `key`, which are compared as in `get_seek_order_by`.
+    """
+    if len(key) != len(ordering):
+        raise InvalidCursor(_('Invalid cursor'))
+
+    clauses = []
+    equal = Q()
+    for (path, desc), value in zip(ordering, key):
+        if value is None and path not in nullable:
+            raise InvalidCursor(_('Invalid cursor'))
+        after = get_seek_after(path, desc, value, path in nullable)
+        if after is not None:
+            clauses.append(equal & after)
+        if value is None:
+            equal &= Q(**{'%s__isnull' % path: True})
+        else:
+            equal &= Q(**{path: value})
+
+    (first_path, first_desc), first_value = ordering[0], key[0]
+    first_range = get_seek_after(
+        first_path, first_desc, first_value, first_path in nullable,
+        inclusive=True
+    )
+    return first_range & reduce(or_, clauses)
+
+
+def get_seek_key(model, ordering, obj):
+    """Get the sort key of `obj`, a model instance or a FastQuery row."""
+    key = []
+    for path, _desc in ordering:
+        try:
+            field = model._meta.get_field(path)
+        except FieldDoesNotExist:
+            field = None
+        if path == 'pk':
+            name = model._meta.pk.attname
+        elif field is not None and field.concrete and not field.is_relation:
+            name = field.attname
+        else:
+            break
+
+        try:
+            key.append(
+                obj[name] if hasattr(obj, 'keys') else getattr(obj, name)
+            )
+        except (KeyError, AttributeError):
+            break
+    else:
+        return key
+
+    # Related or missing sort fields: read them from the database.
+    return list(
+        model._default_manager.filter(pk=obj.pk).values_list(
+            *[path for path, _desc in ordering]
+        ).get()
+    )
+
+
+class CursorJSONEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder truncates to milliseconds, keys must be exact.
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super(CursorJSONEncoder, self).default(o)
+
+
+def encode_cursor(ordering, key, reverse=False):
+    """Encode a position in `ordering` as an opaque string.
+
+    Cursors point at the rows after `key`, or before it if `reverse`
+    is set.
+    """
+    data = {'o': get_seek_order_by(ordering), 'k': key}
+    if reverse:
+        data['r'] = 1
+    data = json.dumps(data, cls=CursorJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+# the JSON scalars a sort key can hold
+CURSOR_KEY_TYPES = (type(None), bool, int, float, str)
+
+
+def decode_cursor(ordering, cursor):
+    """Decode a cursor from `encode_cursor`.
+
+    Returns:
+        A tuple of the sort key and whether the cursor is reversed.
+    """
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        order_by, key = data['o'], data['k']
+        reverse = bool(data.get('r'))
+    except (
+        TypeError, ValueError, KeyError, AttributeError, binascii.Error
+    ):
+        raise InvalidCursor(_('Invalid cursor'))
+
+    if order_by != get_seek_order_by(ordering):
+        raise InvalidCursor(_('The cursor is for a different ordering'))
+    if (
+        not isinstance(key, list) or
+        len(key) != len(ordering) or
+        not all(isinstance(value, CURSOR_KEY_TYPES) for value in key)
+    ):
+        raise InvalidCursor(_('Invalid cursor'))
+    return key, reverse
+
+
+def is_unfiltered(query):
+    """Whether `query` reads every row of its table exactly once."""
+    return (
+        not query.where and
+        query.group_by is None and
+        not query.combinator and
+        query.low_mark == 0 and
+        query.high_mark is None
+    )
+
+
+def estimate_postgresql_count(queryset, cursor):
+    if is_unfiltered(queryset.query):
+        cursor.execute(
+            'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+            [queryset.model._meta.db_table]
+        )
+        row = cursor.fetchone()
+        # -1 if the table was never analyzed
+        if row is not None and row[0] >= 0:
+            return int(row[0])
+
+    sql, params = queryset.query.sql_with_params()
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def estimate_sqlite_count(queryset, cursor):
+    # SQLite doesn't expose row estimates for queries, only the table
+    # statistics gathered by ANALYZE.
+    if not is_unfiltered(queryset.query):
+        return None
+
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' "
+        "AND name = 'sqlite_stat1'"
+    )
+    if cursor.fetchone() is None:
+        return None
+
+    cursor.execute(
+        'SELECT stat FROM sqlite_stat1 WHERE tbl = %s',
+        [queryset.model._meta.db_table]
+    )
+    # the first number of each row is the number of rows in the index
+    counts = [int(stat.split()[0]) for stat, in cursor.fetchall()]
+    return max(counts) if counts else None
+
+
+COUNT_ESTIMATORS = {
+    'postgresql': estimate_postgresql_count,
+    'sqlite': estimate_sqlite_count,
+}
+
+
+def estimate_count(queryset):
+    """Estimate the number of rows of `queryset` from the database's
+    statistics.
+
+    Returns:
+        The estimate, or None if the database can't provide one.
+    """
+    connection = connections[queryset.db]
+    estimator = COUNT_ESTIMATORS.get(connection.vendor)
+    if estimator is None:
+        return None
+
+    queryset = queryset.order_by()
+    try:
+        # a savepoint, so that a failure doesn't break the transaction
+        with transaction.atomic(using=queryset.db):
+            with connection.cursor() as cursor:
+                return estimator(queryset, cursor)
+    except (DatabaseError, EmptyResultSet, LookupError, ValueError):
+        return None
+
+
+def get_cached_count(queryset):
+    """Count `queryset`, caching the result (see `caching.CountCache`)."""
+    queryset = queryset.order_by()
+    query = queryset.query
+    try:
+        sql, params = query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+
+    key = (queryset.db, sql, repr(params))
+    count = count_cache.get(key)
+    if count is not None:
+        return count
+
+    tables = {queryset.model._meta.db_table}
+    tables.update(join.table_name for join in query.alias_map.values())
+    tables = tuple(sorted(tables))
+    # Taken before the query runs, see `FastQueryCache.set`.
+    versions = count_cache.get_versions(tables)
+    count = queryset.count()
+    count_cache.set(key, tables, versions, count)
+    return count
+
+
 class DynamicPaginator(Paginator):
 
     def __init__(self, *args, **kwargs):
         self.exclude_count = kwargs.pop('exclude_count', False)
+        self.count_strategy = (
+            kwargs.pop('count_strategy', None) or
+            settings.PAGINATION_COUNT_STRATEGY
+        )
+        # the strategy that produced `count`
+        self.count_strategy_used = None
         super().__init__(*args, **kwargs)
 
+    @property
+    def count_is_estimated(self):
+        return self.count_strategy_used == COUNT_ESTIMATED
+
     def validate_number(self, number):
         """Validate the given 1-based page number."""
         try:
@@ -35,6 +387,9 @@ class DynamicPaginator(Paginator):
         if number > self.num_pages:
             if number == 1 and self.allow_empty_first_page:
                 pass
+            elif self.count_is_estimated:
+                # the estimate may be short, let the page be empty instead
+                pass
             else:
                 raise EmptyPage(_('That page contains no results'))
         return number
@@ -49,18 +404,107 @@ class DynamicPaginator(Paginator):
             # to determine if more pages are available
             # and skip validation against count
             top = top + 1
-        else:
+        elif not self.count_is_estimated:
             if top + self.orphans >= self.count:
                 top = self.count
         return self._get_page(self.object_list[bottom:top], number, self)
 
+    def seek_page(self, cursor=None):
+        """Return the page at `cursor` (or the first page).
+
+        Returns:
+            A tuple of the page's objects and the cursor of the next page
+            (None if this is the last page).
+        """
+        objects, next_cursor, _previous_cursor = self.seek(cursor)
+        return objects, next_cursor
+
+    def seek(self, cursor=None):
+        """Return the page at `cursor` (or the first page).
+
+        Instead of an OFFSET, rows are filtered by their sort key, so the
+        cost of a page doesn't depend on how deep it is. Previous cursors
+        read the rows before their key in reverse order, which costs the
+        same.
+
+        Returns:
+            A tuple of the page's objects and the cursors of the next
+            and previous pages (None if there are none).
+        """
+        object_list = self.object_list
+        ordering = get_seek_ordering(object_list)
+        nullable = get_nullable_paths(object_list.model, ordering)
+        seek_ordering = ordering
+        key = None
+        reverse = False
+        if cursor:
+            key, reverse = decode_cursor(ordering, cursor)
+            if reverse:
+                seek_ordering = get_reverse_seek_ordering(ordering)
+        object_list = object_list.order_by(
+            *get_seek_order_by(seek_ordering, nullable)
+        )
+        if key is not None:
+            try:
+                object_list = object_list.filter(
+                    get_seek_filter(seek_ordering, key, nullable)
+                )
+            except (TypeError, ValueError, ValidationError):
+                # values that don't fit their fields
+                raise InvalidCursor(_('Invalid cursor'))
+
+        # fetch one extra item to determine if there are more pages
+        objects = list(object_list[:self.per_page + 1])
+        more_pages = len(objects) > self.per_page
+        objects = objects[:self.per_page]
+        if reverse:
+            objects.reverse()
+        if not objects:
+            return objects, None, None
+
+        # The row at the cursor's key is on the page the cursor came from.
+        has_next = key is not None if reverse else more_pages
+        has_previous = more_pages if reverse else key is not None
+        model = object_list.model
+        next_cursor = previous_cursor = None
+        if has_next:
+            next_cursor = encode_cursor(
+                ordering, get_seek_key(model, ordering, objects[-1])
+            )
+        if has_previous:
+            previous_cursor = encode_cursor(
+                ordering, get_seek_key(model, ordering, objects[0]),
+                reverse=True
+            )
+        return objects, next_cursor, previous_cursor
+
     @cached_property
     def count(self):
-        """Return the total number of objects, across all pages."""
+        """Return the total number of objects, across all pages.
+
+        Querysets (and FastQueries) are counted according to
+        `count_strategy`, see `PAGINATION_COUNT_STRATEGY`.
+        """
         if self.exclude_count:
             # always return 0, count should not be called
             return 0
 
+        # the queryset behind a FastQuery
+        queryset = getattr(self.object_list, 'queryset', self.object_list)
+        if hasattr(queryset, 'query'):
+            if self.count_strategy == COUNT_ESTIMATED:
+                estimate = estimate_count(queryset)
+                if (
+                    estimate is not None and
+                    estimate >= settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD
+                ):
+                    self.count_strategy_used = COUNT_ESTIMATED
+                    return estimate
+            elif self.count_strategy == COUNT_CACHED:
+                self.count_strategy_used = COUNT_CACHED
+                return get_cached_count(queryset)
+
+        self.count_strategy_used = COUNT_EXACT
         c = getattr(self.object_list, 'count', None)
         if callable(c) and not inspect.isbuiltin(c) and method_has_no_args(c):
             return c()
@@ -0,0 +1,163 @@
+"""This module contains the field path index of serializers.
+
+API field paths like `created_by.first_name` are resolved to ORM lookups
+by filtering (`filter{...}`), sorting (`sort[]`) and metadata. Resolving
+a path walks the serializers along it, so resolved paths are indexed
+per serializer class, and each path is resolved once per process.
+"""
+from tools.dynamic_rest.caching import is_fields_cache_enabled
+from tools.dynamic_rest.conf import settings
+from tools.dynamic_rest.fields import DynamicRelationField
+from tools.dynamic_rest.meta import get_model_field
+from tools.dynamic_rest.related import RelatedObject
+
+
+class FieldPath(object):
+    """A resolved API field path.
+
+    Attributes:
+        path: A tuple of field names.
+        filter_lookup: The ORM lookup to filter on, or None if the path
+            can't be filtered on.
+        field: The last serializer field on the path, used to coerce
+            filter values (see `filters.FilterNode.generate_query_key`).
+            Shared by all requests: it must only be read.
+        sort_lookup: The ORM lookup to sort by, or None if the path
+            can't be sorted by.
+    """
+
+    __slots__ = ('path', 'filter_lookup', 'field', 'sort_lookup')
+
+    def __init__(self, path, filter_lookup, field, sort_lookup):
+        self.path = path
+        self.filter_lookup = filter_lookup
+        self.field = field
+        self.sort_lookup = sort_lookup
+
+    @property
+    def filterable(self):
+        return self.filter_lookup is not None
+
+    @property
+    def sortable(self):
+        return self.sort_lookup is not None
+
+
+def join_lookups(*lookups):
+    if None in lookups:
+        return None
+    return '__'.join(lookups)
+
+
+class FieldPathIndex(object):
+    """The field paths reachable from a serializer class.
+
+    Paths are resolved on first use and indexed up to
+    `FIELD_PATH_INDEX_MAX_DEPTH` fields deep. Nested paths are resolved
+    through the indexes of the related serializer classes.
+
+    Only serializers whose fields don't vary by request can be indexed
+    (see `ENABLE_FIELDS_CACHE`). Paths that can't be resolved here, e.g.
+    invalid paths or paths through such serializers, resolve to None:
+    callers fall back to walking the path with their own serializer,
+    which also reports errors.
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self.paths = {}
+        self._serializer = None
+
+    @property
+    def serializer(self):
+        if self._serializer is None:
+            self._serializer = self.serializer_class()
+        return self._serializer
+
+    def get(self, path):
+        """Get the `FieldPath` of a sequence of field names, or None."""
+        path = tuple(path)
+        field_path = self.paths.get(path)
+        if field_path is None and path:
+            field_path = self._resolve(path)
+            if (
+                field_path is not None and
+                len(path) <= settings.FIELD_PATH_INDEX_MAX_DEPTH
+            ):
+                self.paths[path] = field_path
+        return field_path
+
+    def _resolve(self, path):
+        name, rest = path[0], path[1:]
+
+        if name == 'pk':
+            # As in `FilterNode.generate_query_key`, `pk` filters on the
+            # rest of the path without moving along it.
+            if not rest:
+                return FieldPath(path, 'pk', None, None)
+            tail = self.get(rest)
+            if tail is None or not tail.filterable:
+                return None
+            return FieldPath(
+                path, join_lookups('pk', tail.filter_lookup), tail.field, None
+            )
+
+        fields = self.serializer.get_all_fields()
+        if name not in fields:
+            return None
+        field = fields[name]
+        source = field.source or name
+        filter_lookup = self._get_filter_lookup(source)
+        sort_lookup = source if field.source != '*' else None
+
+        if rest:
+            serializer_class = (
+                field.serializer_class
+                if isinstance(field, DynamicRelationField) else None
+            )
+            if not is_fields_cache_enabled(serializer_class):
+                return None
+            tail = get_field_path_index(serializer_class).get(rest)
+            if tail is None:
+                return None
+            filter_lookup = join_lookups(filter_lookup, tail.filter_lookup)
+            sort_lookup = join_lookups(sort_lookup, tail.sort_lookup)
+            if tail.field is not None:
+                field = tail.field
+
+        if filter_lookup is None and sort_lookup is None:
+            return None
+        return FieldPath(path, filter_lookup, field, sort_lookup)
+
+    def _get_filter_lookup(self, source):
+        try:
+            model_field = get_model_field(
+                self.serializer.get_model(), source
+            )
+        except AttributeError:
+            return None
+        if isinstance(model_field, RelatedObject):
+            # For remote fields, strip off '_set' for filtering.
+            return model_field.field.related_query_name()
+        return source
+
+
+_indexes = {}
+
+
+def get_field_path_index(serializer_class):
+    """Get the `FieldPathIndex` of a serializer class."""
+    index = _indexes.get(serializer_class)
+    if index is None:
+        index = _indexes.setdefault(
+            serializer_class, FieldPathIndex(serializer_class)
+        )
+    return index
+
+
+def get_field_path(serializer, path):
+    """Get the `FieldPath` of `path` (a sequence of field names) from
+    a serializer, or None if it isn't indexed."""
+    if not is_fields_cache_enabled(serializer):
+        return None
+    return get_field_path_index(serializer.__class__).get(path)
@@ -1,10 +1,23 @@
 from collections import defaultdict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 import copy
-import traceback
-
-from django.db import models
-from django.db.models import Prefetch, QuerySet
-
+from itertools import islice
+import threading
+
+from django.core.exceptions import EmptyResultSet
+from django.db import connections, models, router
+from django.db.models import DEFERRED, F, Lookup, Prefetch, QuerySet
+from rest_framework.exceptions import ValidationError
+
+from tools.dynamic_rest.caching import fastquery_cache
+from tools.dynamic_rest.conf import settings
+from tools.dynamic_rest.paginator import (
+    get_nullable_paths,
+    get_seek_filter,
+    get_seek_order_by,
+    get_seek_ordering,
+)
 from tools.dynamic_rest.meta import (
     get_model_field_and_type,
     get_remote_model,
@@ -12,6 +25,56 @@ from tools.dynamic_rest.meta import (
     reverse_o2o_field_name
 )
 
+# Alias of the local ID column in `FastQuery.merge_m2m` join rows.
+M2M_LOCAL_ID = '_fastquery_local_id'
+
+
+class ArrayAny(Lookup):
+    """`<lhs> = ANY(<array>)` (PostgreSQL).
+
+    Unlike `__in`, the values are bound as one array parameter, so the
+    SQL text (and its cached plan) doesn't depend on how many there are.
+    """
+
+    lookup_name = 'any'
+    prepare_rhs = False
+
+    def get_db_prep_lookup(self, value, connection):
+        field = self.lhs.output_field
+        return '%s', [[
+            field.get_db_prep_value(v, connection, prepared=False)
+            for v in value
+        ]]
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        db_type = self.lhs.output_field.cast_db_type(connection)
+        sql = '%s = ANY(%s::%s[])' % (lhs, rhs, db_type)
+        return sql, list(lhs_params) + list(rhs_params)
+
+
+def filter_in(queryset, field, ids):
+    """Yield `queryset` filtered by `<field> IN ids`, in batches.
+
+    Each batch binds at most `FASTQUERY_IN_BATCH_SIZE` IDs. On
+    PostgreSQL, a single query binds all the IDs as one array. Nothing
+    is yielded if there are no IDs.
+    """
+    ids = list(ids)
+    if not ids:
+        return
+
+    if connections[queryset.db].vendor == 'postgresql':
+        yield queryset.filter(ArrayAny(F(field), ids))
+        return
+
+    batch_size = settings.FASTQUERY_IN_BATCH_SIZE or len(ids)
+    for start in range(0, len(ids), batch_size):
+        yield queryset.filter(
+            **{field + '__in': ids[start:start + batch_size]}
+        )
+
 
 class FastObject(dict):
 
@@ -49,38 +112,122 @@ class FastObject(dict):
             super(FastObject, self).__setattr__(name, value)
 
 
-class SlowObject(dict):
+class HybridObject(FastObject):
+    """FastObject for models with `USE_FASTQUERY = False`.
 
-    def __init__(self, slow_object=None, *args, **kwargs):
-        self.pk_field = kwargs.pop('pk_field', 'id')
-        self.data = slow_object
-        return super(SlowObject, self).__init__(slow_object.__dict__, *args)
+    Columns are read from the row like any FastObject. Other attributes
+    (properties, methods) are read from a model instance that is built
+    from the row the first time one is needed, without a query.
+    Relations of that instance are not prefetched.
+    """
+
+    def __init__(self, *args, **kwargs):
+        model = kwargs.pop('model')
+        super(HybridObject, self).__init__(*args, **kwargs)
+        object.__setattr__(self, '_model', model)
+        object.__setattr__(self, '_instance', None)
 
     @property
-    def pk(self):
-        return self[self.pk_field]
+    def instance(self):
+        if self._instance is None:
+            model = self._model
+            names = [field.attname for field in model._meta.concrete_fields]
+            values = [self.get(name, DEFERRED) for name in names]
+            instance = model.from_db(
+                router.db_for_read(model), names, values
+            )
+            object.__setattr__(self, '_instance', instance)
+        return self._instance
+
+    def _slow_getattr(self, name):
+        try:
+            return super(HybridObject, self)._slow_getattr(name)
+        except AttributeError:
+            if name.startswith('__'):
+                raise
+        return getattr(self.instance, name)
+
+
+class FastColumns(object):
+    """Column index shared by all the `FastRow`s of a query."""
+
+    __slots__ = ('index', 'pk_field')
+
+    def __init__(self, names, pk_field='id'):
+        self.index = {name: i for i, name in enumerate(names)}
+        self.pk_field = pk_field
+
+    def add(self, name):
+        return self.index.setdefault(name, len(self.index))
+
+
+class FastRow(Mapping):
+    """Compact, read-mostly alternative to `FastObject`.
 
-    def __getitem__(self, value):
+    Values are stored positionally and looked up through a `FastColumns`
+    index that is shared by every row of the query, so a row costs one
+    list instead of one dict. Setting an unknown key adds a column to the
+    shared index (this is how prefetches are merged in).
+    """
+
+    __slots__ = ('_columns', '_values')
 
-        if hasattr(self.data, str(value)):
-            return getattr(self.data, str(value))
+    def __init__(self, columns, values):
+        object.__setattr__(self, '_columns', columns)
+        object.__setattr__(self, '_values', values)
 
-        # for the purposse of mapping serialized model + '_id' fields back to
-        # internal models, we need to check if that pattern is present
-        is_nested_obj = value.split('_')
-        test_attr = '_'.join(is_nested_obj[:-1])
-        attr_exists = hasattr(self.data, test_attr)
-        if is_nested_obj[-1] == 'id' and attr_exists:
-            return getattr(self.data, test_attr).id
+    @property
+    def pk_field(self):
+        return self._columns.pk_field
 
-        return None
+    @property
+    def pk(self):
+        return self[self._columns.pk_field]
+
+    def __getitem__(self, name):
+        try:
+            value = self._values[self._columns.index[name]]
+        except (KeyError, IndexError):
+            raise KeyError(name)
+        if value is _MISSING:
+            raise KeyError(name)
+        return value
+
+    def __setitem__(self, name, value):
+        i = self._columns.add(name)
+        values = self._values
+        if i >= len(values):
+            values.extend([_MISSING] * (i + 1 - len(values)))
+        values[i] = value
+
+    def __contains__(self, name):
+        i = self._columns.index.get(name)
+        values = self._values
+        return (
+            i is not None and i < len(values) and values[i] is not _MISSING
+        )
 
     def __iter__(self):
-        return iter([self.data])
+        values = self._values
+        for name, i in self._columns.index.items():
+            if i < len(values) and values[i] is not _MISSING:
+                yield name
 
-    def __getattr__(self, value):
-        # EAFP
-        return getattr(self.data, str(value))
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return 'FastRow(%r)' % dict(self)
+
+    _slow_getattr = FastObject._slow_getattr
+    __getattr__ = FastObject.__getattr__
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+
+# Placeholder for columns added after a `FastRow` was created.
+_MISSING = object()
 
 
 class FastList(list):
@@ -107,21 +254,23 @@ class FastPrefetch(object):
             'make_from_field required model+field_name or field'
         )
 
-        # For nested prefetch, only handle first level.
-        field_parts = field_name.split('__')
-        field_name = field_parts[0]
-        nested_prefetches = '__'.join(field_parts[1:])
+        # Nested lookups like "a__b__c" become a tree with one
+        # FastPrefetch per level. Each level is merged with a single
+        # batched query for all of its parents.
+        field_name, _, nested_prefetches = field_name.partition('__')
 
-        field, ftype = get_model_field_and_type(model, field_name)
+        try:
+            field, ftype = get_model_field_and_type(model, field_name)
+        except AttributeError as e:
+            raise ValidationError(str(e))
         if not ftype:
-            raise RuntimeError("%s is not prefetchable" % field_name)
+            raise ValidationError("%s is not prefetchable" % field_name)
 
         qs = get_remote_model(field).objects.all()
 
         field_name = field_name or field.name
         prefetch = cls(field_name, qs)
 
-        # For nested prefetch, recursively pass down remainder
         if nested_prefetches:
             prefetch.query.prefetch_related(nested_prefetches)
 
@@ -131,17 +280,40 @@ class FastPrefetch(object):
     def make_from_prefetch(cls, prefetch, parent_model):
         assert isinstance(prefetch, Prefetch)
 
-        if isinstance(prefetch.queryset, FastQuery):
-            return cls(
-                prefetch.prefetch_through,
-                prefetch.queryset
+        field_name, _, nested_prefetches = (
+            prefetch.prefetch_through.partition('__')
+        )
+        if nested_prefetches:
+            # The queryset applies to the last level of the lookup.
+            fast_prefetch = cls.make_from_field(
+                model=parent_model,
+                field_name=field_name
             )
+            fast_prefetch.query.prefetch_related(
+                Prefetch(nested_prefetches, queryset=prefetch.queryset)
+            )
+            return fast_prefetch
+        elif prefetch.queryset is not None:
+            return cls(field_name, prefetch.queryset)
         else:
             return cls.make_from_field(
                 model=parent_model,
-                field_name=prefetch.prefetch_through
+                field_name=field_name
             )
 
+    def merge(self, other):
+        """Merge another prefetch of the same field into this one."""
+        if self.query is None:
+            self.query = other.query
+        elif other.query is not None:
+            query = self.query
+            if query.fields is not None and other.query.fields is not None:
+                query.fields = query.fields | other.query.fields
+            else:
+                query.fields = None
+            query.prefetch_related(*other.query.prefetches.values())
+        return self
+
 
 class FastQueryCompatMixin(object):
     """ Mixins for FastQuery to provide QuerySet-compatibility APIs.
@@ -150,33 +322,30 @@ class FastQueryCompatMixin(object):
     """
 
     def prefetch_related(self, *args):
-        try:
-            for arg in args:
-                if isinstance(arg, str):
-                    arg = FastPrefetch.make_from_field(
-                        model=self.model,
-                        field_name=arg
-                    )
-                elif isinstance(arg, Prefetch):
-                    arg = FastPrefetch.make_from_prefetch(arg, self.model)
-                if not isinstance(arg, FastPrefetch):
-                    raise Exception("Must be FastPrefetch object")
-
-                if arg.field in self.prefetches:
-                    raise Exception(
-                        "Prefetch for field '%s' already exists."
-                    )
+        for arg in args:
+            if isinstance(arg, str):
+                arg = FastPrefetch.make_from_field(
+                    model=self.model,
+                    field_name=arg
+                )
+            elif isinstance(arg, Prefetch):
+                arg = FastPrefetch.make_from_prefetch(arg, self.model)
+            if not isinstance(arg, FastPrefetch):
+                raise TypeError("Must be FastPrefetch object")
+
+            if arg.field in self.prefetches:
+                # e.g. "a__b" and "a__c" share the "a" level
+                self.prefetches[arg.field].merge(arg)
+            else:
                 self.prefetches[arg.field] = arg
-        except Exception as e:  # noqa
-            traceback.print_exc()
 
         return self
 
     def only(self, *fields):
-        # TODO: support this for realz
-        '''
-        self.fields = set(self.fields) + set(fields)
-        '''
+        # Like QuerySet.only(), a later call replaces the earlier field set.
+        # The pk and any columns needed to merge prefetches are always
+        # selected, see `FastQuery._get_values_fields`.
+        self.fields = set(fields)
         return self
 
     def exclude(self, *args, **kwargs):
@@ -218,8 +387,12 @@ class FastQueryCompatMixin(object):
         return self.queryset.query
 
     def _clone(self):
+        # Like QuerySet._clone(), the clone does not share the result cache.
         new = copy.copy(self)
         new.queryset = new.queryset._clone()
+        new.prefetches = dict(new.prefetches)
+        new._data = None
+        new._my_ids = None
         return new
 
     def _get_django_queryset(self):
@@ -227,8 +400,9 @@ class FastQueryCompatMixin(object):
 
         prefetches = []
         for field, fprefetch in self.prefetches.items():
-            has_query = hasattr(fprefetch, 'query')
-            qs = fprefetch.query.queryset if has_query else None
+            qs = None
+            if fprefetch.query is not None:
+                qs = fprefetch.query._get_django_queryset()
             prefetches.append(
                 Prefetch(field, queryset=qs)
             )
@@ -254,50 +428,119 @@ class FastQuery(FastQueryCompatMixin, object):
         self.prefetches = {}
         self.fields = None
         self.pk_field = queryset.model._meta.pk.attname
+        # Models that need more than their columns (properties, methods)
+        # set `USE_FASTQUERY = False` and get `HybridObject` rows.
+        self.hybrid = not getattr(self.model, 'USE_FASTQUERY', True)
         self._data = None
         self._my_ids = None
+        self._use_cache = False
+        self._cache_timeout = None
+
+    def cache(self, timeout=None):
+        """Cache the results of `execute()` across requests.
+
+        `timeout` defaults to `FASTQUERY_CACHE_TIMEOUT`. See
+        `caching.FastQueryCache` for how entries are invalidated.
+        """
+        self._use_cache = True
+        self._cache_timeout = timeout
+        return self
 
     def execute(self):
         if self._data is not None:
             return self._data
 
+        cache_key = self._get_cache_key() if self._use_cache else None
+        if cache_key is not None:
+            data = fastquery_cache.get(cache_key)
+            if data is not None:
+                self._data = data
+                return data
+            # Taken before the query runs, see `FastQueryCache.set`.
+            tables = self._get_cache_tables()
+            versions = fastquery_cache.get_versions(tables)
+
         # TODO: check if queryset already has values() called
-        # TODO: use self.fields
         qs = self.queryset._clone()
 
-        use_fastquery = getattr(self.model, 'USE_FASTQUERY', True)
+        data = list(self._get_rows(qs))
 
-        if use_fastquery:
-            data = list(qs.values())
+        self.merge_prefetch(data)
+        self._data = FastList(map(self._to_object, data))
 
-            self.merge_prefetch(data)
-            self._data = FastList(
-                map(lambda obj: FastObject(obj, pk_field=self.pk_field), data)
-            )
-        else:
-            def make_prefetch(fast_prefetch):
-                queryset = None
-                if fast_prefetch.query is not None:
-                    queryset = fast_prefetch.query.queryset
-                return Prefetch(
-                    fast_prefetch.field,
-                    queryset=queryset
-                )
-            prefetches = [
-                make_prefetch(
-                    prefetch
-                ) for prefetch in self.prefetches.values()
-            ]
-            if len(prefetches) > 0:
-                qs = qs.prefetch_related(*prefetches)
-            self._data = FastList(
-                map(lambda obj: SlowObject(
-                    obj, pk_field=self.pk_field
-                ), qs.all())
+        if cache_key is not None:
+            fastquery_cache.set(
+                cache_key,
+                tables,
+                versions,
+                self._data,
+                timeout=self._cache_timeout
             )
 
         return self._data
 
+    def _get_cache_key(self):
+        """Fingerprint this query's SQL and its prefetch tree.
+
+        Returns None if the query can't match any rows.
+        """
+        try:
+            sql, params = self.queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return None
+
+        prefetches = []
+        for field, prefetch in sorted(self.prefetches.items()):
+            query = prefetch.query
+            prefetches.append(
+                (field, query._get_cache_key() if query is not None else None)
+            )
+
+        return (
+            self.queryset.db,
+            sql,
+            repr(params),
+            tuple(self._get_values_fields()),
+            self.hybrid,
+            settings.FASTQUERY_COMPACT_ROWS,
+            tuple(prefetches),
+        )
+
+    def _get_cache_tables(self):
+        """Get the tables read by this query and its prefetch tree."""
+        tables = {self.model._meta.db_table}
+        tables.update(
+            join.table_name
+            for join in self.queryset.query.alias_map.values()
+        )
+        for prefetch in self.prefetches.values():
+            if prefetch.query is not None:
+                tables.update(prefetch.query._get_cache_tables())
+        return tuple(sorted(tables))
+
+    def iterator(self, chunk_size=2000):
+        """Stream results, merging prefetches one chunk at a time.
+
+        The root queryset is read with a server-side cursor (where the
+        database supports it) in chunks of `chunk_size` rows, so peak
+        memory is bounded by the chunk size instead of the result size.
+        As with `QuerySet.iterator()`, results are not cached.
+        """
+        if self._data is not None:
+            yield from self._data
+            return
+
+        rows = self._get_rows(
+            self.queryset._clone(), chunk_size=chunk_size
+        )
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            self.merge_prefetch(chunk)
+            for row in chunk:
+                yield self._to_object(row)
+
     def __iter__(self):
         """Allow this to be cast to an iterable.
         Note: as with Django QuerySets, calling this will cause the
@@ -325,8 +568,11 @@ class FastQuery(FastQueryCompatMixin, object):
             if k.step:
                 raise TypeError("Stepping not supported")
 
-            self.queryset.query.set_limits(start, stop)
-            return self.execute()
+            # Like QuerySet slicing, this is lazy, so that slices (e.g.
+            # pages) can still be streamed with `iterator()`.
+            clone = self._clone()
+            clone.queryset.query.set_limits(start, stop)
+            return clone
         else:
             self.queryset.query.set_limits(k, k+1)
             return self.execute()
@@ -334,22 +580,120 @@ class FastQuery(FastQueryCompatMixin, object):
     def __len__(self):
         return len(self.execute())
 
+    def _require_fields(self, *fields):
+        """Make sure `fields` are selected, even if `only()` was called."""
+        if self.fields is not None:
+            self.fields = self.fields | set(fields)
+        return self
+
+    def _get_values_fields(self):
+        """Get the columns to pass to `values()`.
+
+        Returns an empty list (i.e. all columns) unless `only()` was
+        called. Otherwise returns the attnames of the requested local
+        fields plus the pk, the FK columns that `merge_fk` reads, and
+        any annotations or extra selects on the queryset.
+        """
+        if self.fields is None:
+            return []
+
+        requested = self.fields
+        values_fields = [
+            field.attname for field in self.model._meta.concrete_fields
+            if (
+                field.primary_key or
+                field.name in requested or
+                field.attname in requested or
+                # FK/O2O columns required by merge_fk
+                field.name in self.prefetches
+            )
+        ]
+
+        query = self.queryset.query
+        values_fields.extend(query.extra_select)
+        values_fields.extend(query.annotation_select)
+        return values_fields
+
+    def _get_column_names(self):
+        """Like `_get_values_fields`, but always lists the columns."""
+        values_fields = self._get_values_fields()
+        if values_fields:
+            return values_fields
+
+        query = self.queryset.query
+        return [
+            field.attname for field in self.model._meta.concrete_fields
+        ] + list(query.extra_select) + list(query.annotation_select)
+
+    def _get_rows(self, qs, chunk_size=None):
+        """Read `qs` as mutable rows: dicts, or `FastRow`s if compact."""
+        if self.hybrid or not settings.FASTQUERY_COMPACT_ROWS:
+            rows = qs.values(*self._get_values_fields())
+            if chunk_size:
+                rows = rows.iterator(chunk_size=chunk_size)
+            return rows
+
+        names = self._get_column_names()
+        columns = FastColumns(names, pk_field=self.pk_field)
+        rows = qs.values_list(*names)
+        if chunk_size:
+            rows = rows.iterator(chunk_size=chunk_size)
+        return (FastRow(columns, list(values)) for values in rows)
+
+    def _to_object(self, row):
+        if isinstance(row, FastRow):
+            return row
+        if self.hybrid:
+            return HybridObject(row, pk_field=self.pk_field, model=self.model)
+        return FastObject(row, pk_field=self.pk_field)
+
     def get_ids(self, ids):
         self.queryset = self.queryset.filter(pk__in=ids)
         return self
 
+    def seek(self, key):
+        """Keep only the rows that come after sort key `key`.
+
+        `key` holds the values of the ordering fields, plus the pk (see
+        `paginator.get_seek_ordering`), of the last row seen. Slicing the
+        result, e.g. `query.seek(key)[:20]`, reads the next rows without
+        an OFFSET.
+        """
+        ordering = get_seek_ordering(self.queryset)
+        nullable = get_nullable_paths(self.model, ordering)
+        self.queryset = self.queryset.order_by(
+            *get_seek_order_by(ordering, nullable)
+        ).filter(get_seek_filter(ordering, key, nullable))
+        return self
+
+    def execute_in(self, field, ids):
+        """Execute, filtered by `<field> IN ids`.
+
+        Unlike `filter()`, large ID sets are split across queries, see
+        `filter_in`. Results of each batch are concatenated.
+        """
+        data = FastList()
+        for queryset in filter_in(self.queryset, field, ids):
+            query = self._clone()
+            query.queryset = queryset
+            data.extend(query.execute())
+        return data
+
     def merge_prefetch(self, data):
 
         model = self.queryset.model
+        # `data` may be a new chunk, see `iterator()`.
+        self._my_ids = None
 
         rel_func_map = {
-            'fk': self.merge_fk,
-            'o2o': self.merge_o2o,
-            'o2or': self.merge_o2or,
-            'm2m': self.merge_m2m,
-            'm2o': self.merge_m2o,
+            'fk': self.fetch_fk,
+            'o2o': self.fetch_fk,
+            'o2or': self.fetch_o2or,
+            'm2m': self.fetch_m2m,
+            'm2o': self.fetch_m2o,
         }
 
+        fetches = []
         for prefetch in self.prefetches.values():
             # TODO: here we assume we're dealing with Prefetch objects
             #       we could support field notation as well.
@@ -361,8 +705,28 @@ class FastQuery(FastQueryCompatMixin, object):
                 # TODO: maybe raise?
                 continue
 
-            func = rel_func_map[rel_type]
-            func(data, field, prefetch)
+            fetches.append((rel_func_map[rel_type], field, prefetch))
+
+        # Each fetch runs the queries for one prefetch and returns a
+        # function that merges the results into `data`. Fetches only read
+        # `data`, so they can run concurrently; merging always happens
+        # here, in order.
+        self._get_my_ids(data)
+        if _can_fetch_concurrently(fetches):
+            executor = _get_prefetch_executor()
+            futures = [
+                executor.submit(_run_fetch, fetch, data, field, prefetch)
+                for fetch, field, prefetch in fetches
+            ]
+            merges = [future.result() for future in futures]
+        else:
+            merges = [
+                fetch(data, field, prefetch)
+                for fetch, field, prefetch in fetches
+            ]
+
+        for merge in merges:
+            merge(data)
 
         return data
 
@@ -379,6 +743,9 @@ class FastQuery(FastQueryCompatMixin, object):
         return self._my_ids
 
     def merge_fk(self, data, field, prefetch):
+        return self.fetch_fk(data, field, prefetch)(data)
+
+    def fetch_fk(self, data, field, prefetch):
         # Strategy: pull out field_id values from each row, pass to
         #           prefetch queryset using `pk__in`.
 
@@ -386,19 +753,24 @@ class FastQuery(FastQueryCompatMixin, object):
         ids = set([
             row[id_field] for row in data if id_field in row
         ])
-        prefetched_data = prefetch.query.get_ids(ids).execute()
+        prefetched_data = prefetch.query.execute_in('pk', ids)
         id_map = self._make_id_map(prefetched_data)
 
-        for row in data:
-            row[field.name] = id_map.get(row[id_field], None)
+        def merge(data):
+            for row in data:
+                row[field.name] = id_map.get(row[id_field], None)
+            return data
 
-        return data
+        return merge
 
     def merge_o2o(self, data, field, prefetch):
         # Same as FK.
         return self.merge_fk(data, field, prefetch)
 
     def merge_o2or(self, data, field, prefetch, m2o_mode=False):
+        return self.fetch_o2or(data, field, prefetch, m2o_mode)(data)
+
+    def fetch_o2or(self, data, field, prefetch, m2o_mode=False):
         # Strategy: get my IDs, filter remote model for rows pointing at
         #           my IDs.
         #           For m2o_mode, account for there many objects, while
@@ -409,42 +781,87 @@ class FastQuery(FastQueryCompatMixin, object):
         # If prefetching User.profile, construct filter like:
         #   Profile.objects.filter(user__in=<user_ids>)
         remote_field = reverse_o2o_field_name(field)
-        remote_filter_key = '%s__in' % remote_field
-        filter_args = {remote_filter_key: my_ids}
-
-        # Fetch remote objects
-        remote_objects = prefetch.query.filter(**filter_args).execute()
-        id_map = self._make_id_map(data, pk_field=self.pk_field)
-
-        field_name = prefetch.field
-        reverse_found = set()  # IDs of local objects that were reversed
-        for remote_obj in remote_objects:
-            # Pull out ref on remote object pointing at us, and
-            # get local object. There *should* always be a matching
-            # local object because the remote objects were filtered
-            # for those that referenced the local IDs.
-            reverse_ref = remote_obj[remote_field]
-            local_obj = id_map[reverse_ref]
-
-            if m2o_mode:
-                # in many-to-one mode, this is a list
-                if field_name not in local_obj:
-                    local_obj[field_name] = FastList([])
-                local_obj[field_name].append(remote_obj)
-            else:
-                # in o2or mode, there can only be one
-                local_obj[field_name] = remote_obj
 
-            reverse_found.add(reverse_ref)
+        # Fetch remote objects, making sure the reverse key gets selected
+        remote_objects = prefetch.query._clone()._require_fields(
+            remote_field
+        ).execute_in(remote_field, my_ids)
+
+        def merge(data):
+            id_map = self._make_id_map(data, pk_field=self.pk_field)
+
+            field_name = prefetch.field
+            reverse_found = set()  # IDs of local objects that were reversed
+            for remote_obj in remote_objects:
+                # Pull out ref on remote object pointing at us, and
+                # get local object. There *should* always be a matching
+                # local object because the remote objects were filtered
+                # for those that referenced the local IDs.
+                reverse_ref = remote_obj[remote_field]
+                local_obj = id_map[reverse_ref]
+
+                if m2o_mode:
+                    # in many-to-one mode, this is a list
+                    if field_name not in local_obj:
+                        local_obj[field_name] = FastList([])
+                    local_obj[field_name].append(remote_obj)
+                else:
+                    # in o2or mode, there can only be one
+                    local_obj[field_name] = remote_obj
+
+                reverse_found.add(reverse_ref)
+
+            # Set value to None for objects that didn't have a matching
+            # prefetch
+            not_found = my_ids - reverse_found
+            for pk in not_found:
+                id_map[pk][field_name] = FastList([]) if m2o_mode else None
+
+            return data
+
+        return merge
 
-        # Set value to None for objects that didn't have a matching prefetch
-        not_found = my_ids - reverse_found
-        for pk in not_found:
-            id_map[pk][field_name] = FastList([]) if m2o_mode else None
+    def merge_m2m(self, data, field, prefetch):
+        return self.fetch_m2m(data, field, prefetch)(data)
 
-        return data
+    def fetch_m2m(self, data, field, prefetch):
+        reverse_field = reverse_m2m_field_name(field)
+        if reverse_field is None or not settings.FASTQUERY_M2M_JOIN:
+            return self._fetch_m2m_separate(data, field, prefetch)
 
-    def merge_m2m(self, data, field, prefetch):
+        # Strategy: one query on the remote model, joined to the through
+        # table, that returns each remote row along with the ID of the
+        # local object it belongs to.
+        # e.g.: If prefetching User.groups, do
+        #       Groups.filter(users__in=<user_ids>).values(..., users)
+        query = prefetch.query._clone()
+        remote_pk_field = query.pk_field
+        values_fields = query._get_column_names()
+        batches = filter_in(
+            query.queryset, reverse_field, self._get_my_ids(data)
+        )
+
+        joins = []
+        remote_rows = {}
+        for queryset in batches:
+            # F() reuses the join set up by the filter.
+            rows = queryset.values(
+                *values_fields, **{M2M_LOCAL_ID: F(reverse_field)}
+            )
+            for row in rows:
+                local_id = row.pop(M2M_LOCAL_ID)
+                remote_id = row[remote_pk_field]
+                remote_rows.setdefault(remote_id, row)
+                joins.append((remote_id, local_id))
+
+        query.merge_prefetch(list(remote_rows.values()))
+        id_map = {
+            remote_id: query._to_object(row)
+            for remote_id, row in remote_rows.items()
+        }
+        return self._make_m2m_merge(prefetch, joins, id_map)
+
+    def _fetch_m2m_separate(self, data, field, prefetch):
         # Strategy: pull out all my IDs, do a reverse filter on remote object.
         # e.g.: If prefetching User.groups, do
         #       Groups.filter(users__in=<user_ids>)
@@ -455,35 +872,35 @@ class FastQuery(FastQueryCompatMixin, object):
         remote_pk_field = base_qs.model._meta.pk.attname  # get pk field name
         reverse_field = reverse_m2m_field_name(field)
 
+        joins = []
         if reverse_field is None:
             # Note: We can't just reuse self.queryset here because it's
             #       been sliced already.
             filters = {
                 field.attname + '__isnull': False
             }
-            qs = self.queryset.model.objects.filter(
-                pk__in=my_ids, **filters
-            )
-            joins = list(qs.values_list(
-                field.attname,
-                self.pk_field
-            ))
+            qs = self.queryset.model.objects.filter(**filters)
+            for batch in filter_in(qs, 'pk', my_ids):
+                joins.extend(batch.values_list(
+                    field.attname,
+                    self.pk_field
+                ))
         else:
             # Get reverse mapping (for User.groups, get Group.users)
             # Note: `qs` already has base filter applied on remote model.
-            filters = {
-                reverse_field+'__in': my_ids
-            }
-            joins = list(base_qs.filter(**filters).values_list(
-                remote_pk_field,
-                reverse_field
-            ))
+            for batch in filter_in(base_qs, reverse_field, my_ids):
+                joins.extend(batch.values_list(
+                    remote_pk_field,
+                    reverse_field
+                ))
 
         # Fetch remote objects, as values.
         remote_ids = set([o[0] for o in joins])
-        remote_objects = prefetch.query.get_ids(remote_ids).execute()
+        remote_objects = prefetch.query.execute_in('pk', remote_ids)
         id_map = self._make_id_map(remote_objects, pk_field=remote_pk_field)
+        return self._make_m2m_merge(prefetch, joins, id_map)
 
+    def _make_m2m_merge(self, prefetch, joins, id_map):
         # Create mapping of local ID -> remote objects
         to_field = prefetch.field
         object_map = defaultdict(FastList)
@@ -491,12 +908,63 @@ class FastQuery(FastQueryCompatMixin, object):
             if remote_id in id_map:
                 object_map[local_id].append(id_map[remote_id])
 
-        # Merge into working data set.
-        for row in data:
-            row[to_field] = object_map[row[self.pk_field]]
+        def merge(data):
+            # Merge into working data set.
+            for row in data:
+                row[to_field] = object_map[row[self.pk_field]]
+            return data
 
-        return data
+        return merge
 
     def merge_m2o(self, data, field, prefetch):
         # Same as o2or but allow for many reverse objects.
         return self.merge_o2or(data, field, prefetch, m2o_mode=True)
+
+    def fetch_m2o(self, data, field, prefetch):
+        return self.fetch_o2or(data, field, prefetch, m2o_mode=True)
+
+
+_prefetch_executor = (0, None)
+_prefetch_executor_lock = threading.Lock()
+_prefetch_local = threading.local()
+
+
+def _get_prefetch_executor():
+    """Get the shared pool used to fetch prefetches concurrently."""
+    global _prefetch_executor
+    workers = settings.FASTQUERY_PREFETCH_THREADS
+    with _prefetch_executor_lock:
+        size, executor = _prefetch_executor
+        if executor is None or size != workers:
+            if executor is not None:
+                executor.shutdown(wait=False)
+            executor = ThreadPoolExecutor(
+                max_workers=workers,
+                thread_name_prefix='fastquery-prefetch'
+            )
+            _prefetch_executor = (workers, executor)
+        return executor
+
+
+def _can_fetch_concurrently(fetches):
+    if settings.FASTQUERY_PREFETCH_THREADS < 2 or len(fetches) < 2:
+        return False
+    if getattr(_prefetch_local, 'in_worker', False):
+        # Nested prefetches run in the worker that fetches their parent,
+        # waiting on the bounded pool from inside it could deadlock.
+        return False
+    # Other connections can't see this transaction's uncommitted writes.
+    return not any(
+        connection.in_atomic_block
+        for connection in connections.all(initialized_only=True)
+    )
+
+
+def _run_fetch(fetch, data, field, prefetch):
+    _prefetch_local.in_worker = True
+    try:
+        return fetch(data, field, prefetch)
+    finally:
+        # Worker threads get their own connections, close them so they
+        # don't outlive the request.
+        connections.close_all()
@@ -1,5 +1,6 @@
 """This module contains response processors."""
 
+import time
 from collections import defaultdict
 
 import six
@@ -7,10 +8,11 @@ from rest_framework.serializers import ListSerializer
 from rest_framework.utils.serializer_helpers import ReturnDict
 
 from tools.dynamic_rest.conf import settings
-from tools.dynamic_rest.tagged import TaggedDict
-
+from tools.dynamic_rest.links import get_link_templates
+from tools.dynamic_rest.tagged import get_tags
 
 POST_PROCESSORS = {}
+SIDELOADING_HOOKS = {}
 
 
 def register_post_processor(func):
@@ -33,6 +35,24 @@ def register_post_processor(func):
     return func
 
 
+def register_sideloading_hook(func):
+    """
+    Register an instrumentation hook, called with the processor and its
+    `stats` after every sideloading pass.
+
+    Usage:
+        @register_sideloading_hook
+        def log_sideloading(processor, stats):
+            logger.info("%(nodes)d nodes in %(time).3fs", stats)
+    """
+
+    global SIDELOADING_HOOKS
+
+    key = func.__name__
+    SIDELOADING_HOOKS[key] = func
+    return func
+
+
 def post_process(data):
     """Apply registered post-processors to data."""
 
@@ -42,6 +62,16 @@ def post_process(data):
     return data
 
 
+def get_pk_key(pk):
+    """Get a hashable key for a record's pk.
+
+    Polymorphic relations represent pks as dicts of type and id.
+    """
+    if isinstance(pk, dict):
+        return tuple(six.iteritems(pk))
+    return pk
+
+
 class SideloadingProcessor(object):
     """A processor that sideloads serializer data.
 
@@ -58,19 +88,45 @@ class SideloadingProcessor(object):
             data: the serializer's representation
         """
 
-        if isinstance(serializer, ListSerializer):
-            serializer = serializer.child
-        self.data = {}
-        self.seen = defaultdict(set)
-        self.plural_name = serializer.get_plural_name()
-        self.name = serializer.get_name()
+        self.setup(serializer)
 
         # process the data, optionally sideloading
         self.process(data)
+        self.report()
 
         # add the primary resource data into the response data
         resource_name = self.name if isinstance(data, dict) else self.plural_name
         self.data[resource_name] = data
+        self.add_link_templates()
+
+    def setup(self, serializer):
+        if isinstance(serializer, ListSerializer):
+            serializer = serializer.child
+        self.data = {}
+        # resource name -> pk key -> sideloaded record, or None for
+        # primary records
+        self.seen = defaultdict(dict)
+        self.plural_name = serializer.get_plural_name()
+        self.name = serializer.get_name()
+        self.tags = get_tags(serializer.context)
+        self.link_templates = get_link_templates(serializer.context)
+        self.max_depth = settings.SIDELOADING_MAX_DEPTH
+        self.relation_names = {}
+        # nodes: lists and dicts visited, time: seconds spent processing
+        self.stats = {"nodes": 0, "time": 0.0}
+
+    def report(self):
+        """Pass the stats of the processor to the sideloading hooks."""
+        for hook in SIDELOADING_HOOKS.values():
+            hook(self, self.stats)
+
+    def add_link_templates(self):
+        """Add the link templates of records rendered by convention.
+
+        See `links.LinkTemplate`.
+        """
+        if self.link_templates:
+            self.data["links"] = self.link_templates
 
     def is_dynamic(self, data):
         """Check whether the given data dictionary is a DREST structure.
@@ -78,74 +134,137 @@ class SideloadingProcessor(object):
         Arguments:
             data: A dictionary representation of a DRF serializer.
         """
-        return isinstance(data, TaggedDict)
+        return self.tags.get(data) is not None
+
+    def get_relation_names(self, serializer):
+        """Get the keys of a record that can hold nested records.
+
+        Returns:
+            A tuple of keys, or None if any key can.
+        """
+        try:
+            return self.relation_names[serializer]
+        except KeyError:
+            get_names = getattr(serializer, "get_relation_field_names", None)
+            names = get_names() if get_names else None
+            self.relation_names[serializer] = names
+            return names
 
     def process(self, obj, parent=None, parent_key=None, depth=0):
-        """Recursively process the data for sideloading.
+        """Process the data for sideloading.
 
         Converts the nested representation into a sideloaded representation.
+        Records are walked depth-first with a worklist rather than
+        recursively, descending only into relation fields (see
+        `get_relation_names`) and no more than `max_depth` levels down.
+        Records are sideloaded after their relations, as they would be by a
+        recursive walk.
         """
-        if isinstance(obj, list):
-            for key, o in enumerate(obj):
+        start = time.perf_counter()
+        get_tag = self.tags.get
+        max_depth = self.max_depth
+        nodes = 0
+
+        # (obj, parent, parent_key, depth, tag), where `tag` is set once
+        # the relations of the record `obj` have been processed
+        stack = [(obj, parent, parent_key, depth, None)]
+        while stack:
+            obj, parent, parent_key, depth, tag = stack.pop()
+            if tag is not None:
+                self.sideload(obj, tag, parent, parent_key, depth)
+                continue
+
+            nodes += 1
+            if isinstance(obj, list):
                 # traverse into lists of objects
-                self.process(o, parent=obj, parent_key=key, depth=depth)
-        elif isinstance(obj, dict):
-            dynamic = self.is_dynamic(obj)
-            returned = isinstance(obj, ReturnDict)
-            if dynamic or returned:
-                # recursively check all fields
-                for key, o in six.iteritems(obj):
-                    if isinstance(o, list) or isinstance(o, dict):
-                        # lists or dicts indicate a relation
-                        self.process(o, parent=obj, parent_key=key, depth=depth + 1)
-
-                if not dynamic or getattr(obj, "embed", False):
-                    return
-
-                serializer = obj.serializer
-                name = serializer.get_plural_name()
-                instance = getattr(obj, "instance", serializer.instance)
-                instance_pk = instance.pk if instance else None
-                pk = getattr(obj, "pk_value", instance_pk) or instance_pk
-
-                # For polymorphic relations, `pk` can be a dict, so use the
-                # string representation (dict isn't hashable).
-                pk_key = repr(pk)
-
-                # sideloading
-                seen = True
-                # if this object has not yet been seen
-                if pk_key not in self.seen[name]:
-                    seen = False
-                    self.seen[name].add(pk_key)
-
-                # prevent sideloading the primary objects
-                if depth == 0:
-                    return
-
-                # TODO: spec out the exact behavior for secondary instances of
-                # the primary resource
-
-                # if the primary resource is embedded, add it to a prefixed key
-                if name == self.plural_name:
-                    name = "%s%s" % (settings.ADDITIONAL_PRIMARY_RESOURCE_PREFIX, name)
-
-                if not seen:
-                    # allocate a top-level key in the data for this resource
-                    # type
-                    if name not in self.data:
-                        self.data[name] = []
-
-                    # move the object into a new top-level bucket
-                    # and mark it as seen
-                    self.data[name].append(obj)
-                else:
-                    # obj sideloaded, but maybe with other fields
-                    for o in self.data.get(name, []):
-                        if o.instance.pk == pk:
-                            o.update(obj)
-                            break
-
-                # replace the object with a reference
-                if parent is not None and parent_key is not None:
-                    parent[parent_key] = pk
+                for key in range(len(obj) - 1, -1, -1):
+                    o = obj[key]
+                    if isinstance(o, (list, dict)):
+                        stack.append((o, obj, key, depth, None))
+                continue
+
+            tag = get_tag(obj)
+            if tag is not None:
+                if not tag.embed:
+                    stack.append((obj, parent, parent_key, depth, tag))
+                names = self.get_relation_names(tag.serializer)
+            elif isinstance(obj, ReturnDict):
+                names = self.get_relation_names(getattr(obj, "serializer", None))
+            else:
+                continue
+
+            if max_depth is not None and depth >= max_depth:
+                continue
+
+            # lists or dicts in relation fields hold related records
+            keys = list(obj) if names is None else [n for n in names if n in obj]
+            for key in reversed(keys):
+                o = obj[key]
+                if isinstance(o, (list, dict)):
+                    stack.append((o, obj, key, depth + 1, None))
+
+        self.stats["nodes"] += nodes
+        self.stats["time"] += time.perf_counter() - start
+
+    def sideload(self, obj, tag, parent, parent_key, depth):
+        """Sideload the record `obj`, unless it is a primary record."""
+        serializer = tag.serializer
+        name = serializer.get_plural_name()
+        instance = tag.instance
+        instance_pk = instance.pk if instance else None
+        pk = tag.pk_value or instance_pk
+
+        pk_key = get_pk_key(pk)
+        seen = self.seen[name]
+
+        # prevent sideloading the primary objects
+        if depth == 0:
+            seen.setdefault(pk_key, None)
+            return
+
+        # TODO: spec out the exact behavior for secondary instances of
+        # the primary resource
+
+        # if the primary resource is embedded, add it to a prefixed key
+        if name == self.plural_name:
+            name = "%s%s" % (settings.ADDITIONAL_PRIMARY_RESOURCE_PREFIX, name)
+
+        if pk_key not in seen:
+            # allocate a top-level key in the data for this resource
+            # type
+            if name not in self.data:
+                self.data[name] = []
+
+            # move the object into a new top-level bucket
+            # and mark it as seen
+            self.data[name].append(obj)
+            seen[pk_key] = obj
+        else:
+            # obj sideloaded, but maybe with other fields
+            record = seen[pk_key]
+            if record is not None and record is not obj:
+                record.update(obj)
+
+        # replace the object with a reference
+        if parent is not None and parent_key is not None:
+            parent[parent_key] = pk
+
+
+class StreamingSideloadingProcessor(SideloadingProcessor):
+    """A SideloadingProcessor that is fed primary records one at a time.
+
+    Records are sideloaded as they are added and can be written out
+    right away; only the sideloaded records are kept, in `data`.
+    Call `add_link_templates()` and `report()` once all the records
+    have been added.
+    """
+
+    def __init__(self, serializer):
+        self.setup(serializer)
+
+    def add(self, record):
+        """Sideload the relations of a primary record."""
+        self.process(record)
+        # primary records are written out right away, don't keep them
+        self.tags.discard(record)
+        return record
@@ -1,5 +1,62 @@
 """This module contains custom renderer classes."""
-from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class DynamicJSONRenderer(JSONRenderer):
+    """A faster JSONRenderer, using orjson if it is installed.
+
+    orjson encodes dicts and lists (including ReturnDicts, FastObjects
+    and FastLists) and UUIDs natively. Other types (datetimes, Decimals,
+    FastRows, ...) are passed to `encoder_class`, so they are encoded
+    exactly as JSONRenderer does.
+
+    Falls back on JSONRenderer when orjson is not installed, for
+    indented or non-compact output (e.g. `; indent=4`), for ASCII-only
+    output, and for data orjson can't encode (e.g. integers over 64
+    bits).
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None or
+            data is None or
+            self.ensure_ascii or
+            not self.compact or
+            self.get_indent(
+                accepted_media_type, renderer_context or {}
+            ) is not None
+        ):
+            return super(DynamicJSONRenderer, self).render(
+                data, accepted_media_type, renderer_context
+            )
+
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                # let the encoder format datetimes, as JSONRenderer does
+                option=(
+                    orjson.OPT_NON_STR_KEYS |
+                    orjson.OPT_PASSTHROUGH_DATETIME
+                )
+            )
+        except orjson.JSONEncodeError:
+            return super(DynamicJSONRenderer, self).render(
+                data, accepted_media_type, renderer_context
+            )
+
+        # like JSONRenderer, escape the characters that JavaScript doesn't
+        # allow in strings
+        return ret.replace(
+            b'\xe2\x80\xa8', b'\\u2028'
+        ).replace(
+            b'\xe2\x80\xa9', b'\\u2029'
+        )
 
 
 class DynamicBrowsableAPIRenderer(BrowsableAPIRenderer):
@@ -1,8 +1,11 @@
 """This module contains custom serializer classes."""
 import copy
 import inspect
-import os
+import itertools
+import threading
 import traceback
+from collections import OrderedDict
+from collections.abc import Mapping
 
 import inflection
 from django.db import models
@@ -11,7 +14,7 @@ from django.utils.functional import cached_property
 from rest_framework import __version__ as drf_version
 from rest_framework import exceptions, fields, serializers
 from rest_framework.relations import RelatedField
-from rest_framework.fields import SkipField
+from rest_framework.fields import SkipField, is_simple_callable
 from rest_framework.serializers import raise_errors_on_nested_writes
 from rest_framework.utils import model_meta
 from rest_framework.utils.serializer_helpers import ReturnDict, ReturnList
@@ -22,24 +25,109 @@ from tools.dynamic_rest.bases import (
     DynamicSerializerBase,
     resettable_cached_property,
 )
+from tools.dynamic_rest.caching import (
+    fields_cache,
+    is_fields_cache_enabled,
+    representation_cache,
+)
+from tools.dynamic_rest.columns import get_column_converter
 from tools.dynamic_rest.conf import settings
 from tools.dynamic_rest.fields import (
     DynamicRelationField,
     DynamicGenericRelationField,
 )
-from tools.dynamic_rest.links import merge_link_object
-from tools.dynamic_rest.meta import get_model_table
+from tools.dynamic_rest.links import (
+    LINKS_BY_CONVENTION_PARAM,
+    LinkTemplate,
+    get_link_templates,
+    merge_link_object,
+)
+from tools.dynamic_rest.meta import (
+    get_model_field,
+    get_model_table,
+    get_related_model,
+    is_field_remote,
+)
 from tools.dynamic_rest.processors import SideloadingProcessor, post_process
-from tools.dynamic_rest.tagged import tag_dict
+from tools.dynamic_rest.tagged import get_tags
 from tools.dynamic_rest.utils import external_id_from_model_and_internal_id
 
-OPTS = {
-    'ENABLE_FIELDS_CACHE': os.environ.get('ENABLE_FIELDS_CACHE', False)
-}
-FIELDS_CACHE = {}
+FAST_ROW_TYPES = (prefetch.FastObject, prefetch.FastRow)
+SERIALIZER_PLANS = OrderedDict()
+SERIALIZER_PLANS_LOCK = threading.Lock()
 DRF_VERSION = drf_version.split('.')
 
 
+class SerializerPlan(object):
+    """The compiled field selection of a serializer.
+
+    A plan is computed once per serializer class and request shape
+    (see `WithDynamicSerializerMixin.get_plan_key`) and shared between
+    serializer instances, so that `get_fields()` doesn't have to redo
+    deferral and flagging work for every serializer it builds.
+    Serializers without `ENABLE_FIELDS_CACHE` compile their own plan.
+    """
+
+    def __init__(self, field_names, flags, relation_names=()):
+        # names of the fields to render, in declaration order
+        self.field_names = field_names
+        # (name, attribute, value) overrides to set on the fields
+        self.flags = flags
+        # names of the rendered fields that can hold nested records
+        self.relation_names = relation_names
+
+    def bind(self, all_fields):
+        """Select and flag the planned fields out of `all_fields`."""
+        fields = {name: all_fields[name] for name in self.field_names}
+        for name, attr, value in self.flags:
+            setattr(fields[name], attr, value)
+        return fields
+
+
+def is_relation_field(field):
+    """Whether `field` represents related records."""
+    return isinstance(
+        field,
+        (
+            DynamicGenericRelationField,
+            DynamicRelationField,
+            serializers.BaseSerializer
+        )
+    )
+
+
+class CopyOnWriteFields(Mapping):
+    """A serializer's fields, copied from shared prototypes on first use.
+
+    Fields that a serializer never looks at (e.g. deferred ones) are
+    never copied. Iterating over the keys doesn't copy anything;
+    the prototypes themselves must only be read.
+    """
+
+    def __init__(self, prototypes, parent):
+        self.prototypes = prototypes
+        self.parent = parent
+        self._fields = {}
+
+    def __getitem__(self, name):
+        field = self._fields.get(name)
+        if field is None:
+            field = copy.deepcopy(self.prototypes[name])
+            field.field_name = name
+            field.parent = self.parent
+            self._fields[name] = field
+        return field
+
+    def __contains__(self, name):
+        return name in self.prototypes
+
+    def __iter__(self):
+        return iter(self.prototypes)
+
+    def __len__(self):
+        return len(self.prototypes)
+
+
 class WithResourceKeyMixin(object):
     def get_resource_key(self):
         """Return canonical resource key, usually the DB table name."""
@@ -69,8 +157,65 @@ class DynamicListSerializer(
         self.child.parent = self
 
     def to_representation(self, data):
-        iterable = data.all() if isinstance(data, models.Manager) else data
-        return [self.child.to_representation(item) for item in iterable]
+        return list(self.iter_representation(data))
+
+    def iter_representation(self, data, chunk_size=None):
+        """Lazily represent `data`, one item at a time.
+
+        Unexecuted FastQuery objects are streamed with
+        `FastQuery.iterator()`, so their rows (and prefetched rows)
+        can be released as soon as each chunk has been represented.
+
+        FastQuery rows are represented a chunk at a time, one column at
+        a time (see `_faster_to_representation_rows`).
+        """
+        chunk_size = chunk_size or settings.STREAM_CHUNK_SIZE
+        if isinstance(data, models.Manager):
+            iterable = data.all()
+        elif isinstance(data, prefetch.FastQuery):
+            iterable = data.iterator(chunk_size=chunk_size)
+        elif chunk_size and isinstance(data, models.QuerySet):
+            iterable = data.iterator(chunk_size=chunk_size)
+        else:
+            iterable = data
+
+        child = self.child
+        if not self._can_represent_columns():
+            for item in iterable:
+                yield child.to_representation(item)
+            return
+
+        iterator = iter(iterable)
+        while True:
+            rows = list(itertools.islice(iterator, chunk_size))
+            if not rows:
+                return
+            if all(isinstance(row, FAST_ROW_TYPES) for row in rows):
+                for representation in child.to_representation_rows(rows):
+                    yield representation
+            else:
+                for row in rows:
+                    yield child.to_representation(row)
+
+    def _can_represent_columns(self):
+        """Whether the child can use `to_representation_rows`."""
+        child = self.child
+        if not isinstance(child, WithDynamicSerializerMixin):
+            return False
+
+        child_class = child.__class__
+        return (
+            child.enable_optimization and
+            not child.id_only() and
+            child._representation_cache_options is None and
+            # don't bypass customized representations
+            child_class.to_representation is
+            WithDynamicSerializerMixin.to_representation and
+            child_class._to_representation is
+            WithDynamicSerializerMixin._to_representation and
+            child_class._faster_to_representation is
+            WithDynamicSerializerMixin._faster_to_representation
+        )
 
     def get_model(self):
         """Get the child's model."""
@@ -163,9 +308,13 @@ class WithDynamicSerializerMixin(
         - immutable_fields - list of strings
         - read_only_fields - list of strings
         - untrimmed_fields - list of strings
+        - cache_version_field - string, a field that changes whenever
+          the row does (e.g. an `updated` timestamp), used to key the
+          representation cache
     """
 
-    ENABLE_FIELDS_CACHE = False
+    ENABLE_FIELDS_CACHE = True
+    ENABLE_REPRESENTATION_CACHE = True
 
     def __new__(cls, *args, **kwargs):
         """
@@ -382,24 +531,13 @@ class WithDynamicSerializerMixin(
 
         Does not respect dynamic field inclusions/exclusions.
         """
-        if (
-            not settings.ENABLE_FIELDS_CACHE or
-            not self.ENABLE_FIELDS_CACHE or
-            self.__class__ not in FIELDS_CACHE
-        ):
-            all_fields = super(
-                WithDynamicSerializerMixin,
-                self
-            ).get_fields()
-
-            if settings.ENABLE_FIELDS_CACHE and self.ENABLE_FIELDS_CACHE:
-                FIELDS_CACHE[self.__class__] = all_fields
-        else:
-            all_fields = copy.copy(FIELDS_CACHE[self.__class__])
-            for k, field in six.iteritems(all_fields):
-                if hasattr(field, 'reset'):
-                    field.reset()
+        get_fields = super(WithDynamicSerializerMixin, self).get_fields
+        if is_fields_cache_enabled(self):
+            return CopyOnWriteFields(
+                fields_cache.get(self.__class__, get_fields), self
+            )
 
+        all_fields = get_fields()
         for k, field in six.iteritems(all_fields):
             field.field_name = k
             field.parent = self
@@ -437,34 +575,56 @@ class WithDynamicSerializerMixin(
 
         return deferred_fields
 
-    def flag_fields(self, all_fields, fields_to_flag, attr, value):
-        for name in fields_to_flag:
-            field = all_fields.get(name)
-            if not field:
-                continue
-            setattr(field, attr, value)
+    def get_plan_key(self):
+        """Get the key that a compiled `SerializerPlan` is cached by.
 
-    def get_fields(self):
-        """Returns the serializer's field set.
-
-        If `dynamic` is True, respects field inclusions/exlcusions.
-        Otherwise, reverts back to standard DRF behavior.
+        Only the top level of `request_fields` affects this serializer's
+        fields; nested requests are planned by the child serializers.
         """
-        all_fields = self.get_all_fields()
-        if self.dynamic is False:
-            return all_fields
+        shape = tuple(sorted(
+            (name, 'nested' if isinstance(include, dict)
+             else include is not False)
+            for name, include in six.iteritems(self.request_fields)
+        ))
+        return (
+            self.__class__,
+            shape,
+            self.get_request_method() == 'POST',
+            settings.DEFER_MANY_RELATIONS,
+        )
 
-        if self.id_only():
-            return {}
+    def get_plan(self):
+        """Get the compiled `SerializerPlan` of this serializer."""
+        if not is_fields_cache_enabled(self):
+            # fields may depend on the request or context
+            return self._compile_plan(self.get_all_fields())
+
+        key = self.get_plan_key()
+        with SERIALIZER_PLANS_LOCK:
+            plan = SERIALIZER_PLANS.get(key)
+            if plan is not None:
+                SERIALIZER_PLANS.move_to_end(key)
+                return plan
 
-        serializer_fields = copy.deepcopy(all_fields)
+        all_fields = self.get_all_fields()
+        # flags like `deferred` and `many` can be read off the prototypes
+        plan = self._compile_plan(
+            getattr(all_fields, 'prototypes', all_fields)
+        )
+        with SERIALIZER_PLANS_LOCK:
+            SERIALIZER_PLANS[key] = plan
+            while len(SERIALIZER_PLANS) > settings.SERIALIZER_PLAN_CACHE_SIZE:
+                SERIALIZER_PLANS.popitem(last=False)
+        return plan
+
+    def _compile_plan(self, all_fields):
         request_fields = self.request_fields
-        deferred = self._get_deferred_field_names(serializer_fields)
+        deferred = self._get_deferred_field_names(all_fields)
 
         # apply request overrides
         if request_fields:
             for name, include in six.iteritems(request_fields):
-                if name not in serializer_fields:
+                if name not in all_fields:
                     raise exceptions.ParseError(
                         '"%s" is not a valid field name for "%s".' %
                         (name, self.get_name())
@@ -474,37 +634,73 @@ class WithDynamicSerializerMixin(
                 elif include is False:
                     deferred.add(name)
 
-        for name in deferred:
-            serializer_fields.pop(name)
+        field_names = tuple(
+            name for name in all_fields if name not in deferred
+        )
+        fields = {name: all_fields[name] for name in field_names}
+        flags = []
 
         # Set read_only flags based on read_only_fields meta list.
         # Here to cover DynamicFields not covered by DRF.
         ro_fields = getattr(self.Meta, 'read_only_fields', [])
-        self.flag_fields(serializer_fields, ro_fields, 'read_only', True)
+        flags.extend(
+            (name, 'read_only', True) for name in ro_fields
+            if name in fields
+        )
 
         pw_fields = getattr(self.Meta, 'untrimmed_fields', [])
-        self.flag_fields(
-            serializer_fields,
-            pw_fields,
-            'trim_whitespace',
-            False,
+        flags.extend(
+            (name, 'trim_whitespace', False) for name in pw_fields
+            if name in fields
         )
 
         # Toggle read_only flags for immutable fields.
         # Note: This overrides `read_only` if both are set, to allow
         #       inferred DRF fields to be made immutable.
         immutable_field_names = self._get_flagged_field_names(
-            serializer_fields,
+            fields,
             'immutable'
         )
-        self.flag_fields(
-            serializer_fields,
-            immutable_field_names,
-            'read_only',
-            value=False if self.get_request_method() == 'POST' else True,
+        read_only = False if self.get_request_method() == 'POST' else True
+        flags.extend(
+            (name, 'read_only', read_only)
+            for name in sorted(immutable_field_names)
+        )
+
+        relation_names = tuple(
+            name for name in field_names
+            if is_relation_field(fields[name])
         )
+        return SerializerPlan(field_names, tuple(flags), relation_names)
+
+    def get_fields(self):
+        """Returns the serializer's field set.
 
-        return serializer_fields
+        If `dynamic` is True, respects field inclusions/exlcusions.
+        Otherwise, reverts back to standard DRF behavior.
+        """
+        all_fields = self.get_all_fields()
+        if self.dynamic is False:
+            return all_fields
+
+        if self.id_only():
+            return {}
+
+        return self.get_plan().bind(all_fields)
+
+    def get_relation_field_names(self):
+        """Get the names of the rendered fields that can hold nested
+        records, which `SideloadingProcessor` descends into.
+
+        Returns:
+            A tuple of names, or None if any field can.
+        """
+        if self.dynamic is not False and not self.id_only():
+            return self.get_plan().relation_names
+        return tuple(
+            name for name, field in six.iteritems(self.fields)
+            if is_relation_field(field)
+        )
 
     def is_field_sideloaded(self, field_name):
         if not isinstance(self.request_fields, dict):
@@ -514,6 +710,22 @@ class WithDynamicSerializerMixin(
     def get_link_fields(self):
         return self._link_fields
 
+    def get_link_template(self):
+        return self._link_template
+
+    @resettable_cached_property
+    def _link_template(self):
+        """The compiled `LinkTemplate` of this serializer's records."""
+        query_params = self.get_request_attribute('query_params', {})
+        by_convention = LINKS_BY_CONVENTION_PARAM in query_params
+        template = LinkTemplate(self, by_convention=by_convention)
+        if template.templates:
+            # sent once with the response, see `SideloadingProcessor`
+            get_link_templates(self.context).setdefault(
+                self.get_plural_name(), {}
+            ).update(template.templates)
+        return template
+
     @resettable_cached_property
     def _link_fields(self):
         """Construct dict of name:field for linkable fields."""
@@ -522,8 +734,11 @@ class WithDynamicSerializerMixin(
             return {}
         else:
             all_fields = self.get_all_fields()
+            # only copy the fields that are links
+            prototypes = getattr(all_fields, 'prototypes', all_fields)
             return {
-                name: field for name, field in six.iteritems(all_fields)
+                name: all_fields[name]
+                for name, field in six.iteritems(prototypes)
                 if isinstance(field, DynamicRelationField) and
                 getattr(field, 'link', True) and
                 not (
@@ -595,7 +810,7 @@ class WithDynamicSerializerMixin(
         ret = {}
         fields = self._readable_fields
 
-        is_fast = isinstance(instance, prefetch.FastObject)
+        is_fast = isinstance(instance, FAST_ROW_TYPES)
         id_fields = self._readable_id_fields
 
         for field in fields:
@@ -616,19 +831,9 @@ class WithDynamicSerializerMixin(
                     try:
                         attribute = instance[field.source]
                     except KeyError:
-                        # slower, but does more stuff
-                        # Also, some temp debugging
-                        if hasattr(instance, field.source):
-                            attribute = getattr(instance, field.source)
-                        else:
-                            # Fall back on DRF behavior
-                            attribute = field.get_attribute(instance)
-                            print(
-                                'Missing %s from %s' % (
-                                    field.field_name,
-                                    self.__class__.__name__
-                                )
-                            )
+                        attribute = self._get_missing_attribute(
+                            field, instance
+                        )
             else:
                 try:
                     attribute = field.get_attribute(instance)
@@ -644,6 +849,108 @@ class WithDynamicSerializerMixin(
 
         return ret
 
+    def _get_missing_attribute(self, field, instance):
+        """Get the value of a field that is missing from a fast row."""
+        # slower, but does more stuff
+        if hasattr(instance, field.source):
+            attribute = getattr(instance, field.source)
+            # like DRF's `get_attribute`, e.g. for model methods
+            if is_simple_callable(attribute):
+                attribute = attribute()
+            return attribute
+
+        # Fall back on DRF behavior
+        return field.get_attribute(instance)
+
+    def _get_column(self, field, rows, id_fields):
+        """Get the representations of `field` for all `rows`.
+
+        Follows the same rules as `_faster_to_representation`, with
+        `SkipField` values replaced by `SkipField` itself.
+        """
+        if isinstance(
+            field,
+            (DynamicGenericRelationField, DynamicRelationField)
+        ):
+            column = []
+            for row in rows:
+                try:
+                    attribute = field.get_attribute(row)
+                except SkipField:
+                    column.append(SkipField)
+                    continue
+                column.append(
+                    None if attribute is None
+                    else field.to_representation(attribute)
+                )
+            return column
+
+        source = field.source
+        is_id = field in id_fields
+        # values that are used as is, by row index
+        ids = {}
+        attributes = []
+        for i, row in enumerate(rows):
+            if is_id and source not in row:
+                ids[i] = row.get(source + '_id')
+                attributes.append(None)
+                continue
+            try:
+                attributes.append(row[source])
+            except KeyError:
+                attributes.append(self._get_missing_attribute(field, row))
+
+        convert = get_column_converter(field)
+        if not ids and None not in attributes:
+            return convert(field, attributes)
+
+        present = [
+            i for i, attribute in enumerate(attributes)
+            if attribute is not None and i not in ids
+        ]
+        column = [None] * len(rows)
+        values = convert(field, [attributes[i] for i in present])
+        for i, value in zip(present, values):
+            column[i] = value
+        for i, value in six.iteritems(ids):
+            column[i] = value
+        return column
+
+    def _faster_to_representation_rows(self, rows):
+        """Column-at-a-time `_faster_to_representation`.
+
+        Instead of walking all fields for every row, each field converts
+        the values of all rows at once (see `columns.py`).
+
+        Arguments:
+            rows: a list of FastObjects or FastRows
+        Returns:
+            A list of dicts of primitive datatypes.
+        """
+        id_fields = self._readable_id_fields
+        names = []
+        columns = []
+        for field in self._readable_fields:
+            names.append(field.field_name)
+            columns.append(self._get_column(field, rows, id_fields))
+
+        representations = [dict(zip(names, values)) for values in zip(*columns)]
+        for name, column in zip(names, columns):
+            if SkipField in column:
+                for representation, value in zip(representations, column):
+                    if value is SkipField:
+                        del representation[name]
+        return representations
+
+    def to_representation_rows(self, rows):
+        """`to_representation` for a list of FastQuery rows."""
+        return [
+            self._tag_representation(representation, row)
+            for representation, row in zip(
+                self._faster_to_representation_rows(rows), rows
+            )
+        ]
+
     @resettable_cached_property
     def obj_cache(self):
         # Note: This gets cached by resettable_cached_property so this
@@ -660,7 +967,9 @@ class WithDynamicSerializerMixin(
                 WithDynamicSerializerMixin,
                 self
             ).to_representation(instance)
+        return self._tag_representation(representation, instance)
 
+    def _tag_representation(self, representation, instance):
         if settings.ENABLE_LINKS:
             # TODO: Make this function configurable to support other
             #       formats like JSON API link objects.
@@ -675,11 +984,123 @@ class WithDynamicSerializerMixin(
             }
 
         # tag the representation with the serializer and instance
-        return tag_dict(
-            representation,
-            serializer=self,
-            instance=instance,
-            embed=self.embed
+        return self._tags.tag(
+            representation, self, instance, embed=self.embed
+        )
+
+    @resettable_cached_property
+    def _tags(self):
+        return get_tags(self.context)
+
+    @resettable_cached_property
+    def _representation_cache_options(self):
+        """Get the per-serializer parts of representation cache keys.
+
+        Returns:
+            A tuple of (fingerprint, version field, tables), or None if
+            the representation cache can't be used.
+        """
+        model = self.get_model()
+        if (
+            not settings.ENABLE_REPRESENTATION_CACHE or
+            not self.ENABLE_REPRESENTATION_CACHE or
+            model is None or
+            self.debug
+        ):
+            return None
+
+        # With a version field, only changes to remote relations (whose
+        # ids are not stored in the row) need table versions.
+        version_field = getattr(self.Meta, 'cache_version_field', None)
+        tables = set() if version_field else {get_model_table(model)}
+        for name, field in six.iteritems(self.fields):
+            if isinstance(field, DynamicRelationField):
+                serializer = field.serializer
+                serializer = getattr(serializer, 'child', serializer)
+                if not serializer.id_only():
+                    # nested representations are not cached (see below)
+                    return None
+            elif isinstance(field, serializers.BaseSerializer):
+                return None
+
+            source = field.source or name
+            try:
+                if not is_field_remote(model, source):
+                    continue
+                related_model = get_related_model(
+                    get_model_field(model, source)
+                )
+            except AttributeError:
+                # not a model field (e.g. a method field)
+                continue
+            if related_model is not None:
+                tables.add(get_model_table(related_model))
+
+        query_params = self.get_request_attribute('query_params', {})
+        fingerprint = (
+            self.get_plan_key(),
+            settings.ENABLE_LINKS and 'exclude_links' not in query_params,
+            LINKS_BY_CONVENTION_PARAM in query_params,
+        )
+        return fingerprint, version_field, tuple(sorted(tables))
+
+    def get_representation_cache_key(self, instance):
+        """Get the key of `instance` in the representation cache.
+
+        The key is made of the serializer's field plan, the instance's pk
+        and a version token: the versions of the tables the
+        representation reads (bumped by model signals) and, if
+        `Meta.cache_version_field` is set, the row's version.
+
+        Returns:
+            A key, or None if the representation should not be cached.
+        """
+        options = self._representation_cache_options
+        if options is None:
+            return None
+
+        fingerprint, version_field, tables = options
+        token = representation_cache.get_versions(tables)
+        if version_field:
+            # don't load deferred fields just to get a cache key
+            if hasattr(instance, 'keys'):
+                version = instance.get(version_field)
+            else:
+                version = instance.__dict__.get(version_field)
+            if version is None:
+                return None
+            token += (version,)
+        return (fingerprint, instance.pk, token)
+
+    def _get_representation(self, instance):
+        """`_to_representation`, through the representation cache."""
+        key = self.get_representation_cache_key(instance)
+        if key is None:
+            return self._to_representation(instance)
+
+        cached = representation_cache.get(key)
+        if cached is None:
+            representation = self._to_representation(instance)
+            # Nested representations are tagged with their serializers
+            # and instances for sideloading, so only leaves are cached.
+            tags = self._tags
+            if not any(
+                tags.get(value) is not None or (
+                    isinstance(value, list) and
+                    any(tags.get(item) is not None for item in value)
+                )
+                for value in six.itervalues(representation)
+            ):
+                plain = (
+                    OrderedDict
+                    if isinstance(representation, OrderedDict)
+                    else dict
+                )
+                representation_cache.set(key, plain(representation))
+            return representation
+
+        return self._tags.tag(
+            cached.copy(), self, instance, embed=self.embed
         )
 
     def to_representation(self, instance):
@@ -700,11 +1121,13 @@ class WithDynamicSerializerMixin(
 
         pk = getattr(instance, 'pk', None)
 
-        if not settings.ENABLE_SERIALIZER_OBJECT_CACHE or pk is None:
+        if pk is None:
             return self._to_representation(instance)
+        elif not settings.ENABLE_SERIALIZER_OBJECT_CACHE:
+            return self._get_representation(instance)
         else:
             if pk not in self.obj_cache:
-                self.obj_cache[pk] = self._to_representation(instance)
+                self.obj_cache[pk] = self._get_representation(instance)
             return self.obj_cache[pk]
 
     def to_internal_value(self, data):
@@ -944,10 +1367,15 @@ class DynamicEphemeralSerializer(
                 self
             ).to_representation(instance)
         else:
-            data = instance
+            # sideloading replaces nested records, don't change the input
+            data = instance.copy()
             instance = EphemeralObject(data)
 
         if self.id_only():
             return data
         else:
-            return tag_dict(data, serializer=self, instance=instance)
+            return self._tags.tag(data, self, instance)
+
+    def get_relation_field_names(self):
+        # dicts are represented as they are, with or without fields
+        return None
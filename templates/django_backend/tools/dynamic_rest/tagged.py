@@ -1,10 +1,84 @@
 """This module contains tagging utilities for DREST data structures."""
 from collections import OrderedDict
 
+# key of the tag table in serializer contexts
+TAGS_CONTEXT_KEY = '_dynamic_rest_tags'
+
+
+class Tag(object):
+
+    """The serializer and instance that a representation was built from."""
+
+    __slots__ = (
+        'representation', 'serializer', 'instance', 'embed', 'pk_value'
+    )
+
+    def __init__(
+        self, representation, serializer, instance, embed=False, pk_value=None
+    ):
+        self.representation = representation
+        self.serializer = serializer
+        self.instance = instance
+        self.embed = embed
+        self.pk_value = pk_value
+
+
+class Tags(object):
+
+    """
+    Side table of the representations built during a render pass,
+    used by `SideloadingProcessor` to find their serializers and
+    instances.
+
+    Representations stay plain dicts: tags are keyed by their `id()`.
+    Tags hold on to their representations, so an id can't be reused
+    while it is in the table.
+    """
+
+    def __init__(self):
+        self._tags = {}
+
+    def tag(self, representation, serializer, instance, **kwargs):
+        """Tag `representation` and return it."""
+        self._tags[id(representation)] = Tag(
+            representation, serializer, instance, **kwargs
+        )
+        return representation
+
+    def get(self, representation):
+        """Get the tag of `representation`, or None if it isn't tagged.
+
+        TaggedDicts are their own tags.
+        """
+        tag = self._tags.get(id(representation))
+        if tag is None and isinstance(representation, TaggedDict):
+            return representation
+        return tag
+
+    def discard(self, representation):
+        """Forget the tag of `representation`, once it's been processed."""
+        self._tags.pop(id(representation), None)
+
+
+def get_tags(context):
+    """Get the tag table of a serializer context.
+
+    The context is shared by a serializer and its nested serializers,
+    so they all tag into the same table.
+    """
+    tags = context.get(TAGS_CONTEXT_KEY)
+    if tags is None:
+        tags = context[TAGS_CONTEXT_KEY] = Tags()
+    return tags
+
 
 def tag_dict(obj, *args, **kwargs):
     """Create a TaggedDict instance. Will either be a TaggedOrderedDict
-    or TaggedPlainDict depending on the type of `obj`."""
+    or TaggedPlainDict depending on the type of `obj`.
+
+    Deprecated: representations are tagged with `Tags` instead, which
+    doesn't copy them. TaggedDicts are still recognized when sideloading.
+    """
 
     if isinstance(obj, OrderedDict):
         return _TaggedOrderedDict(obj, *args, **kwargs)
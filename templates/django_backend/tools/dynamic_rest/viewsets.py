@@ -1,22 +1,31 @@
 """This module contains custom viewset classes."""
 
+from itertools import chain
 from typing import List
 
 from django.core.exceptions import ObjectDoesNotExist
-from django.http import QueryDict
+from django.http import QueryDict, StreamingHttpResponse
 import six
 import json
 from django.db import transaction, IntegrityError
-from rest_framework import exceptions, status, viewsets, serializers
+from rest_framework import exceptions, mixins, status, viewsets, serializers
 from rest_framework.exceptions import ValidationError
-from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework.response import Response
 
+from tools.dynamic_rest.caching import invalidate_model
 from tools.dynamic_rest.conf import settings
 from tools.dynamic_rest.filters import DynamicFilterBackend, DynamicSortingFilter
 from tools.dynamic_rest.metadata import DynamicMetadata
-from tools.dynamic_rest.pagination import DynamicPageNumberPagination
-from tools.dynamic_rest.processors import SideloadingProcessor
+from tools.dynamic_rest.pagination import (
+    DynamicCursorPagination,
+    DynamicPageNumberPagination,
+)
+from tools.dynamic_rest.processors import (
+    POST_PROCESSORS,
+    SideloadingProcessor,
+    StreamingSideloadingProcessor,
+)
 from tools.dynamic_rest.utils import is_truthy
 
 UPDATE_REQUEST_METHODS = ("PUT", "PATCH", "POST")
@@ -29,6 +38,14 @@ class PaginationParams(serializers.Serializer):
     per_page = serializers.IntegerField()
     total_pages = serializers.IntegerField()
     total_results = serializers.IntegerField()
+    count_strategy = serializers.CharField()
+
+
+class CursorPaginationParams(serializers.Serializer):
+    per_page = serializers.IntegerField()
+    next_cursor = serializers.CharField(allow_null=True)
+    previous_cursor = serializers.CharField(allow_null=True)
+    more_pages = serializers.BooleanField()
 
 
 class ViewSetReturnTypeItem:
@@ -49,6 +66,12 @@ pagination_params = ViewSetReturnTypeItem(
     many=False,
 )
 
+cursor_pagination_params = ViewSetReturnTypeItem(
+    item_key="meta",
+    item_type=CursorPaginationParams(),
+    many=False,
+)
+
 
 class QueryParams(QueryDict):
     """
@@ -93,6 +116,7 @@ class WithDynamicViewSetMixin(object):
     DEBUG = "debug"
     SIDELOADING = "sideloading"
     PATCH_ALL = "patch-all"
+    STREAM = "stream"
     INCLUDE = "include[]"
     EXCLUDE = "exclude[]"
     FILTER = "filter{}"
@@ -113,6 +137,7 @@ class WithDynamicViewSetMixin(object):
         SORT,
         SIDELOADING,
         PATCH_ALL,
+        STREAM,
     )
     meta = None
     filter_backends = (DynamicFilterBackend, DynamicSortingFilter)
@@ -319,6 +344,10 @@ class WithDynamicViewSetMixin(object):
         sideloading = self.get_request_feature(self.SIDELOADING)
         return is_truthy(sideloading) if sideloading is not None else None
 
+    def get_request_stream(self):
+        stream = self.get_request_feature(self.STREAM)
+        return is_truthy(stream) if stream is not None else False
+
     def is_update(self):
         if self.request and self.request.method.upper() in UPDATE_REQUEST_METHODS:
             return True
@@ -371,7 +400,10 @@ class WithDynamicViewSetMixin(object):
         ]
 
         if self.action == "list":
-            items.append(pagination_params)
+            if isinstance(self.paginator, DynamicCursorPagination):
+                items.append(cursor_pagination_params)
+            else:
+                items.append(pagination_params)
 
         return ViewSetReturnType(items=items)
 
@@ -397,6 +429,13 @@ class WithDynamicViewSetMixin(object):
             ):
                 # remove per_page if it is disabled
                 self.request.query_params[self.PER_PAGE] = None
+            if kwargs:
+                # pass extra options (e.g. `lazy`) on to the paginator
+                if self.paginator is None:
+                    return None
+                return self.paginator.paginate_queryset(
+                    *args, request=self.request, view=self, **kwargs
+                )
             return super(WithDynamicViewSetMixin, self).paginate_queryset(
                 *args, **kwargs
             )
@@ -511,7 +550,101 @@ class WithDynamicViewSetMixin(object):
         return data, many
 
 
-class DynamicModelViewSet(WithDynamicViewSetMixin, viewsets.ModelViewSet):
+class DynamicListModelMixin(mixins.ListModelMixin):
+    """ListModelMixin that can stream lists.
+
+    If the request sets `stream=true`, primary records are represented
+    and written out as they are read from the database (see
+    `FastQuery.iterator`), so memory and time to first byte don't grow
+    with the size of the result or page. Sideloaded records are
+    collected on the way and written after the primary records,
+    followed by the pagination `meta`.
+
+    Only JSON renderers can write a list piece by piece: lists in other
+    formats, and lists with registered post-processors (which need the
+    whole response), are not streamed.
+
+    Errors up to the first chunk (e.g. in the query) are handled like in
+    any other response. Once the first chunk is written the status can't
+    change, so a later error ends the response early.
+    """
+
+    def list(self, request, *args, **kwargs):
+        renderer = getattr(request, "accepted_renderer", None)
+        if (
+            not self.get_request_stream()
+            or POST_PROCESSORS
+            or not isinstance(renderer, JSONRenderer)
+        ):
+            return super(DynamicListModelMixin, self).list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        page_size = self._get_list_page_size()
+        if page_size:
+            if not isinstance(self.paginator, DynamicPageNumberPagination):
+                return super(DynamicListModelMixin, self).list(request, *args, **kwargs)
+            queryset = self.paginate_queryset(queryset, lazy=True)
+
+        serializer = self.get_serializer(queryset, many=True)
+        chunks = self._stream_list(serializer, page_size=page_size)
+        # run the query and render the first chunk before responding
+        first = next(chunks)
+        return StreamingHttpResponse(
+            chain([first], chunks), content_type=request.accepted_media_type
+        )
+
+    def _get_list_page_size(self):
+        if self.paginator is None or self.PAGE not in self.features:
+            return None
+        return self.paginator.get_page_size(self.request)
+
+    def _stream_list(self, serializer, page_size=None):
+        renderer = self.request.accepted_renderer
+        media_type = self.request.accepted_media_type
+        renderer_context = self.get_renderer_context()
+
+        def encode(data):
+            return renderer.render(data, media_type, renderer_context)
+
+        chunk_size = settings.STREAM_CHUNK_SIZE
+        representations = serializer.iter_representation(
+            serializer.instance, chunk_size=chunk_size
+        )
+        processor = StreamingSideloadingProcessor(serializer)
+
+        buffer = [b"{%s:[" % encode(serializer.get_plural_name())]
+        separator = b""
+        count = 0
+        for representation in representations:
+            count += 1
+            if page_size and count > page_size:
+                # the extra record of a lazy page, see `end_lazy_page`
+                break
+            buffer.append(separator + encode(processor.add(representation)))
+            separator = b","
+            if count % chunk_size == 0:
+                yield b"".join(buffer)
+                buffer = []
+                # primary records are never repeated, don't keep them around
+                serializer.child.obj_cache.clear()
+        buffer.append(b"]")
+        processor.add_link_templates()
+        processor.report()
+
+        for name, records in six.iteritems(processor.data):
+            buffer.append(b",%s:%s" % (encode(name), encode(records)))
+
+        if page_size:
+            self.paginator.end_lazy_page(count)
+            meta = self.paginator.get_page_metadata()
+            buffer.append(b',"meta":%s' % encode(meta))
+        buffer.append(b"}")
+        yield b"".join(buffer)
+
+
+class DynamicModelViewSet(
+    WithDynamicViewSetMixin, DynamicListModelMixin, viewsets.ModelViewSet
+):
 
     ENABLE_BULK_PARTIAL_CREATION = settings.ENABLE_BULK_PARTIAL_CREATION
     ENABLE_BULK_UPDATE = settings.ENABLE_BULK_UPDATE
@@ -556,13 +689,16 @@ class DynamicModelViewSet(WithDynamicViewSetMixin, viewsets.ModelViewSet):
     def _patch_all_query(self, queryset, data):
         # update by queryset
         try:
-            return queryset.update(**data)
+            updated = queryset.update(**data)
         except Exception as e:
             raise ValidationError(
                 "Failed to bulk-update records:\n"
                 "%s\n"
                 "Data: %s" % (str(e), str(data))
             )
+        # update() sends no signals
+        invalidate_model(queryset.model, using=queryset.db)
+        return updated
 
     def _patch_all_loop(self, queryset, data):
         # update by transaction loop
@@ -677,9 +813,12 @@ class DynamicModelViewSet(WithDynamicViewSetMixin, viewsets.ModelViewSet):
         errors = []
         result = {}
         serializers = []
+        # share the context, and so the tagged representations (see
+        # `tagged.Tags`), with the sideloading processor
+        context = self.get_serializer_context()
 
         for entry in data:
-            serializer = self.get_serializer(data=entry)
+            serializer = self.get_serializer(data=entry, context=context)
             try:
                 serializer.is_valid(raise_exception=True)
             except exceptions.ValidationError as e:
@@ -696,7 +835,7 @@ class DynamicModelViewSet(WithDynamicViewSetMixin, viewsets.ModelViewSet):
                 items.append(serializer.to_representation(serializer.instance))
 
         # Populate serialized data to the result.
-        result = SideloadingProcessor(self.get_serializer(), items).data
+        result = SideloadingProcessor(self.get_serializer(context=context), items).data
 
         # Include errors if any.
         if errors:
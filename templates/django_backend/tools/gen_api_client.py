@@ -6,7 +6,9 @@ from rest_framework import serializers
 from rest_framework.viewsets import GenericViewSet
 
 from _KAHN_PROJECT_SLUG_.settings import PROJECT_ROOT
+from tools.dynamic_rest.conf import settings
 from tools.dynamic_rest.fields import DynamicRelationField
+from tools.dynamic_rest.pagination import DynamicCursorPagination
 from tools.dynamic_rest.serializers import DynamicSerializer, DynamicListSerializer
 from tools.dynamic_rest.viewsets import ViewSetReturnType
 
@@ -39,6 +41,9 @@ class ActionConfig:
         self.path = path
         self.serializer_class = serializer_class
         self.return_type = return_type
+        self.cursor_paginated = action == "list" and isinstance(
+            vs_instance.paginator, DynamicCursorPagination
+        )
         self.name = view_set.serializer_class.get_name()
         self.plural_name = serializer_class.get_plural_name()
 
@@ -243,7 +248,8 @@ class ApiSauceCodegen:
                 for item in config.return_type.items
             )
 
-            return_type = self._client_return_type(f"{{\n{return_type_items}\n}}")
+            response_data_type = f"{{\n{return_type_items}\n}}"
+            return_type = self._client_return_type(response_data_type)
 
             args = ", ".join(f"{arg}: {t}" for arg, t in args)
 
@@ -291,8 +297,32 @@ class ApiSauceCodegen:
                     f" apiClient.{config.verb}(`{path}`{f', {data_param}' if data_param else ''})"
                 )
 
+            if config.cursor_paginated:
+                self._add_cursor_pages_method(method_name, response_data_type)
+
             self._add_serializer_type(config.serializer_class, config)
 
+    def _add_cursor_pages_method(self, method_name, response_data_type):
+        # Walks a cursor-paginated list with its list method, yielding one
+        # response per page until there is no next cursor (or a request fails).
+        cursor_param = settings.CURSOR_QUERY_PARAM
+        pages_method_name = f"{method_name}Pages"
+        lines = [
+            f"const {pages_method_name} = async function* (params: any = {{}}): "
+            f"AsyncGenerator<ApiResponse<{response_data_type}>> {{",
+            "  let cursor: string | null = '';",
+            "  while (cursor !== null) {",
+            f"    const response = await {method_name}({{ ...params, {cursor_param}: cursor }});",
+            "    yield response;",
+            "    if (!response.ok || !response.data) {",
+            "      return;",
+            "    }",
+            "    cursor = response.data.meta.next_cursor;",
+            "  }",
+            "};",
+        ]
+        self.api_methods[pages_method_name] = "\n".join(lines)
+
 
 class RequestsCodegen:
     def __init__(self):